@@ -0,0 +1,114 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from board import serialize_board, deserialize_board
+import graph_dp
+import simulation
+
+
+#runs in a worker process: rebuilds every board of the chunk from its compact
+#bytes and solves it, returns [(index, expected values), ...]
+def solve_serialized_chunk(chunk, engine):
+    engine_function = graph_dp.EXPECTED_VALUE_ENGINES[engine]
+    results = []
+    for index, data in chunk:
+        board_model = deserialize_board(data)
+        results.append((index, engine_function(board_model)))
+    return results
+
+
+#groups the boards into chunks of (index, serialized board) pairs, lazily so
+#a generator of boards is never held in memory all at once
+def serialized_chunks(boards, chunk_size):
+    chunk = []
+    index = 0
+    for board_model in boards:
+        chunk.append((index, serialize_board(board_model)))
+        index = index + 1
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+#solves many boards in a process pool and yields (index, expected values)
+#as soon as each chunk finishes, so results come back in completion order.
+#Only a few chunks per worker are in flight at a time, which keeps memory flat
+#for very long runs
+def iter_solve_boards(boards, workers=None, chunk_size=16, engine="sweep"):
+    if engine not in graph_dp.EXPECTED_VALUE_ENGINES:
+        raise ValueError("Unknown engine")
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be at least 1")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    max_pending = workers * 2
+
+    chunks = serialized_chunks(boards, chunk_size)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for chunk in chunks:
+            pending.add(executor.submit(solve_serialized_chunk, chunk, engine))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for result in future.result():
+                        yield result
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for result in future.result():
+                    yield result
+
+
+#same as iter_solve_boards but waits for everything and returns the expected
+#values in the same order as the boards
+def solve_boards(boards, workers=None, chunk_size=16, engine="sweep"):
+    results = {}
+    for index, expected_values in iter_solve_boards(boards, workers, chunk_size, engine):
+        results[index] = expected_values
+    result_list = []
+    for index in range(len(results)):
+        result_list.append(results[index])
+    return result_list
+
+
+#runs in a worker process: the counts of a range of blocks of a seeded run
+def simulate_serialized_blocks(data, start_column, seed, blocks, block_size, number_of_drops):
+    board_model = deserialize_board(data)
+    counts = [0] * (board_model.number_of_columns + 1)
+    for block in blocks:
+        block_counts = simulation.simulate_block(board_model, start_column, seed, block, block_size, number_of_drops)
+        for index in range(len(counts)):
+            counts[index] = counts[index] + block_counts[index]
+    return counts
+
+
+#simulation.simulate_drops spread over a process pool: the seeded blocks are
+#handed out in contiguous ranges (a few per worker) and the integer counts
+#are summed, so the same seed and number of drops give the same
+#(slot_counts, lost_count) for any number of workers
+def simulate_drops_parallel(board_model, start_column, number_of_drops, seed, workers=None,
+                            block_size=simulation.DROP_BLOCK_SIZE):
+    if start_column < 0 or start_column >= board_model.number_of_columns:
+        raise ValueError("Column is out of bounds")
+    if block_size < 1:
+        raise ValueError("Block size must be at least 1")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    total_blocks = simulation.number_of_blocks(number_of_drops, block_size)
+    blocks_per_task = max(1, -(-total_blocks // (workers * 4)))
+
+    data = serialize_board(board_model)
+    counts = [0] * (board_model.number_of_columns + 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for first_block in range(0, total_blocks, blocks_per_task):
+            blocks = range(first_block, min(first_block + blocks_per_task, total_blocks))
+            futures.append(executor.submit(simulate_serialized_blocks, data, start_column, seed,
+                                           blocks, block_size, number_of_drops))
+        for future in futures:
+            block_counts = future.result()
+            for index in range(len(counts)):
+                counts[index] = counts[index] + block_counts[index]
+    return counts[:-1], counts[-1]
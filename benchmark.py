@@ -0,0 +1,310 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from board import BoardModel, SparseBoardModel, PEG
+import graph_dp
+import simulation
+
+#board sizes (rows, columns) used to compare the expected value engines
+ENGINE_BENCHMARK_SIZES = [(35, 25), (500, 200), (5000, 1000)]
+
+#board sizes and layouts of the operation benchmark, --quick stops at 100x100
+BENCHMARK_SIZES = [(10, 10), (100, 100), (1000, 1000), (10000, 1000)]
+QUICK_BENCHMARK_SIZES = [(10, 10), (100, 100)]
+BENCHMARK_VARIANTS = ("dense", "sparse", "staggered")
+DENSE_PEG_DENSITY = 0.3
+SPARSE_PEG_DENSITY = 0.01
+#build_graph keeps tuples and dictionaries for every peg, bigger boards are skipped
+MAX_GRAPH_PEGS = 10 ** 6
+CHILD_DIRECTION_CALLS = 10000
+SIMULATION_DROPS = 1000
+
+#a timing or memory counts as a regression when it is more than threshold
+#times the baseline and above these floors (smaller numbers are mostly noise)
+REGRESSION_THRESHOLD = 1.5
+MIN_REGRESSION_SECONDS = 0.01
+MIN_REGRESSION_BYTES = 64 * 1024
+
+
+#highest score in the middle, 15 less per column towards the edges (at least 10)
+def default_slot_scores(number_of_columns):
+    slot_scores = []
+    center_column = (number_of_columns - 1) // 2
+    for column in range(number_of_columns):
+        value = 300 - abs(column - center_column) * 15
+        if value < 10:
+            value = 10
+        slot_scores.append(value)
+    return slot_scores
+
+
+#same staggered layout as the default boards (empty top row, alternating
+#inner pegs, peg walls on both edges, highest score in the middle), built
+#straight into a flat cell buffer so very large boards stay cheap to create
+def create_staggered_board(number_of_rows, number_of_columns):
+    cells = bytearray(number_of_rows * number_of_columns)
+    for row in range(1, number_of_rows):
+        base = row * number_of_columns
+        start_column = 1 if row % 2 == 0 else 2
+        for column in range(start_column, number_of_columns - 1, 2):
+            cells[base + column] = PEG
+        cells[base] = PEG
+        cells[base + number_of_columns - 1] = PEG
+
+    return BoardModel(cells, default_slot_scores(number_of_columns), number_of_columns)
+
+
+#every cell is a peg with probability density, from random bytes mapped to
+#EMPTY/PEG in one translate so 10^7 cells take a fraction of a second
+def create_random_board(number_of_rows, number_of_columns, density, seed=0):
+    generator = random.Random(seed)
+    limit = int(density * 256)
+    table = bytes([PEG if value < limit else 0 for value in range(256)])
+    cells = generator.randbytes(number_of_rows * number_of_columns).translate(table)
+    return BoardModel(cells, default_slot_scores(number_of_columns), number_of_columns)
+
+
+#SparseBoardModel with density * rows * columns pegs at random cells
+def create_sparse_board(number_of_rows, number_of_columns, density, seed=0):
+    generator = random.Random(seed)
+    number_of_cells = number_of_rows * number_of_columns
+    peg_cells = generator.sample(range(number_of_cells), int(density * number_of_cells))
+    peg_positions = [divmod(cell, number_of_columns) for cell in peg_cells]
+    return SparseBoardModel(number_of_rows, number_of_columns, peg_positions,
+                            default_slot_scores(number_of_columns))
+
+
+def create_benchmark_board(variant, number_of_rows, number_of_columns, seed=0):
+    if variant == "dense":
+        return create_random_board(number_of_rows, number_of_columns, DENSE_PEG_DENSITY, seed)
+    if variant == "sparse":
+        return create_sparse_board(number_of_rows, number_of_columns, SPARSE_PEG_DENSITY, seed)
+    if variant == "staggered":
+        return create_staggered_board(number_of_rows, number_of_columns)
+    raise ValueError("Unknown board variant")
+
+
+#runs function(board_model) a few times and keeps the fastest run, returns
+#(seconds, result) or (None, error text) when the engine cannot handle the board
+def time_call(function, board_model, repeats):
+    best_time = None
+    result = None
+    for attempt in range(repeats):
+        start_time = time.perf_counter()
+        try:
+            result = function(board_model)
+        except (RecursionError, RuntimeError) as error:
+            return None, type(error).__name__
+        elapsed = time.perf_counter() - start_time
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    return best_time, result
+
+
+def benchmark_expected_value_engines(sizes=None, repeats=3):
+    if sizes is None:
+        sizes = ENGINE_BENCHMARK_SIZES
+    rows_of_results = []
+    for number_of_rows, number_of_columns in sizes:
+        board_model = create_staggered_board(number_of_rows, number_of_columns)
+        reference = None
+        for engine_name, engine in graph_dp.EXPECTED_VALUE_ENGINES.items():
+            if engine_name == "numpy" and graph_dp.numpy is None:
+                rows_of_results.append((number_of_rows, number_of_columns, engine_name, None, "numpy missing"))
+                continue
+            elapsed, result = time_call(engine, board_model, repeats)
+            if elapsed is None:
+                rows_of_results.append((number_of_rows, number_of_columns, engine_name, None, result))
+                continue
+            if reference is None:
+                reference = result
+            note = "same" if result == reference else "DIFFERENT"
+            rows_of_results.append((number_of_rows, number_of_columns, engine_name, elapsed, note))
+    return rows_of_results
+
+
+def print_engine_results(rows_of_results):
+    print("%-12s %-10s %12s  %s" % ("board", "engine", "seconds", "result"))
+    for number_of_rows, number_of_columns, engine_name, elapsed, note in rows_of_results:
+        size_text = "%dx%d" % (number_of_rows, number_of_columns)
+        time_text = "-" if elapsed is None else "%.6f" % elapsed
+        print("%-12s %-10s %12s  %s" % (size_text, engine_name, time_text, note))
+
+
+#the timed operations of one board as (name, function) pairs. The lazy
+#next-peg index is built here first so every operation is timed in its
+#steady state
+def benchmark_operations(board_model):
+    number_of_rows = board_model.number_of_rows
+    number_of_columns = board_model.number_of_columns
+    board_model.next_peg_row(0, 0)
+
+    positions = []
+    for index in range(CHILD_DIRECTION_CALLS):
+        positions.append((index * number_of_rows // CHILD_DIRECTION_CALLS, (index * 7919) % number_of_columns))
+
+    def child_directions():
+        for row, column in positions:
+            board_model.child_direction(row, column, -1)
+            board_model.child_direction(row, column, 1)
+
+    def simulate_falls():
+        generator = random.Random(0)
+        for drop in range(SIMULATION_DROPS):
+            simulation.simulate_fall(board_model, number_of_columns // 2, generator)
+
+    return [
+        ("get_pegs", board_model.get_pegs),
+        ("child_direction", child_directions),
+        ("build_graph", lambda: graph_dp.build_graph(board_model)),
+        ("compute_expected_values", lambda: graph_dp.compute_expected_values(board_model)),
+        ("choose_best_column", lambda: graph_dp.choose_best_column(board_model, use_cache=False)),
+        ("simulate_fall", simulate_falls),
+    ]
+
+
+#best time of a few runs, then one more run under tracemalloc for the peak
+#memory (tracemalloc slows the code down, so it is never timed)
+def measure(function, repeats):
+    best_time = None
+    for attempt in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start_time
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    tracemalloc.start()
+    function()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_time, peak
+
+
+#times every operation on every variant and size, returns one dict per
+#(variant, size, operation) with seconds and peak_bytes, or skipped
+def benchmark_board_operations(sizes=None, variants=BENCHMARK_VARIANTS, repeats=3):
+    if sizes is None:
+        sizes = BENCHMARK_SIZES
+    results = []
+    for number_of_rows, number_of_columns in sizes:
+        for variant in variants:
+            board_model = create_benchmark_board(variant, number_of_rows, number_of_columns)
+            number_of_pegs = board_model.count_pegs()
+            for operation_name, function in benchmark_operations(board_model):
+                result = {
+                    "variant": variant,
+                    "rows": number_of_rows,
+                    "columns": number_of_columns,
+                    "pegs": number_of_pegs,
+                    "operation": operation_name,
+                }
+                if operation_name == "build_graph" and number_of_pegs > MAX_GRAPH_PEGS:
+                    result["skipped"] = "more than %d pegs" % MAX_GRAPH_PEGS
+                else:
+                    result["seconds"], result["peak_bytes"] = measure(function, repeats)
+                results.append(result)
+            graph_dp.clear_cache()
+    return results
+
+
+def result_key(result):
+    return "%s %dx%d %s" % (result["variant"], result["rows"], result["columns"], result["operation"])
+
+
+#compares results with a baseline run (same JSON layout as write_results),
+#returns one dict per metric that got more than threshold times worse
+def compare_with_baseline(results, baseline_results, threshold=REGRESSION_THRESHOLD):
+    baseline_by_key = {}
+    for result in baseline_results:
+        baseline_by_key[result_key(result)] = result
+    regressions = []
+    for result in results:
+        baseline = baseline_by_key.get(result_key(result))
+        if baseline is None or "skipped" in result or "skipped" in baseline:
+            continue
+        for metric, floor in (("seconds", MIN_REGRESSION_SECONDS), ("peak_bytes", MIN_REGRESSION_BYTES)):
+            if result[metric] < floor:
+                continue
+            if result[metric] > baseline[metric] * threshold:
+                regressions.append({
+                    "key": result_key(result),
+                    "metric": metric,
+                    "baseline": baseline[metric],
+                    "current": result[metric],
+                    "ratio": result[metric] / baseline[metric] if baseline[metric] else float("inf"),
+                })
+    return regressions
+
+
+def write_results(path, results):
+    document = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w") as output_file:
+        json.dump(document, output_file, indent=1)
+
+
+def read_results(path):
+    with open(path) as input_file:
+        return json.load(input_file)["results"]
+
+
+def print_operation_results(results):
+    print("%-10s %-12s %9s %-24s %12s %12s" % ("variant", "board", "pegs", "operation", "seconds", "peak KiB"))
+    for result in results:
+        size_text = "%dx%d" % (result["rows"], result["columns"])
+        if "skipped" in result:
+            print("%-10s %-12s %9d %-24s %12s %12s  skipped: %s" % (result["variant"], size_text, result["pegs"],
+                                                                   result["operation"], "-", "-", result["skipped"]))
+            continue
+        print("%-10s %-12s %9d %-24s %12.6f %12.1f" % (result["variant"], size_text, result["pegs"], result["operation"],
+                                                     result["seconds"], result["peak_bytes"] / 1024.0))
+
+
+def print_regressions(regressions):
+    if not regressions:
+        print("No regressions against the baseline")
+        return
+    print("REGRESSIONS:")
+    for regression in regressions:
+        print("  %-50s %-10s %.6g -> %.6g (x%.2f)" % (regression["key"], regression["metric"], regression["baseline"],
+                                                     regression["current"], regression["ratio"]))
+
+
+#python benchmark.py [--quick] [--json out.json] [--baseline old.json]
+#Returns 1 when the run is slower or bigger than the baseline, so it can
+#gate a CI job. --engines runs the old expected value engine comparison
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the board, graph_dp and simulation operations")
+    parser.add_argument("--engines", action="store_true", help="compare the expected value engines instead")
+    parser.add_argument("--quick", action="store_true", help="only the small boards")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    arguments = parser.parse_args(argv)
+
+    if arguments.engines:
+        print_engine_results(benchmark_expected_value_engines(repeats=arguments.repeats))
+        return 0
+
+    sizes = QUICK_BENCHMARK_SIZES if arguments.quick else BENCHMARK_SIZES
+    results = benchmark_board_operations(sizes, repeats=arguments.repeats)
+    print_operation_results(results)
+    if arguments.json:
+        write_results(arguments.json, results)
+    if arguments.baseline:
+        regressions = compare_with_baseline(results, read_results(arguments.baseline), arguments.threshold)
+        print_regressions(regressions)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
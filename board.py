@@ -1,43 +1,273 @@
+import struct
+from array import array
+from bisect import bisect_left
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 EMPTY = 0
 PEG = 1
 
+HASH_MASK = (1 << 64) - 1
+
+# 64-bit mix (splitmix64) of a cell index, the board fingerprint is the XOR of
+# these over all pegs so adding or removing one peg is a single XOR
+def cell_hash(index):
+    value = (index + 0x9E3779B97F4A7C15) & HASH_MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & HASH_MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & HASH_MASK
+    return value ^ (value >> 31)
+
+# hash of a biased peg (left probability other than 0.5), XORed into the
+# fingerprint the same way as the pegs themselves
+def probability_hash(index, probability):
+    return cell_hash(cell_hash(index) ^ (hash(probability) & HASH_MASK))
+
+def check_probability(probability):
+    if not (0.0 <= probability <= 1.0):
+        raise ValueError("Invalid probability")
+
+# True when probabilities[start:end], the pegs of one row from left to right,
+# are each 1 - the probability of the mirror peg (start + end - 1 - index)
+def probabilities_are_mirrored(probabilities, start, end):
+    for index in range(start, end):
+        left_probability = probabilities[index]
+        mirror_probability = probabilities[start + end - 1 - index]
+        if left_probability != 1.0 - mirror_probability or 1.0 - left_probability != mirror_probability:
+            return False
+    return True
+
+# the cells live in one flat bytearray (one byte per cell, row after row),
+# grid[row] gives a zero-copy read-only memoryview of that row so
+# grid[row][column] still reads like the old list of lists; writes must go
+# through set_cell so the indexes, hashes and listeners stay current
+class GridRows:
+    def __init__(self, board_model):
+        self.board_model = board_model
+
+    def __len__(self):
+        return self.board_model.number_of_rows
+
+    def __getitem__(self, row):
+        return self.board_model.row_view(row)
+
+    def __iter__(self):
+        for row in range(self.board_model.number_of_rows):
+            yield self.board_model.row_view(row)
+
+# grid is a list of rows (lists of EMPTY/PEG), or, when number_of_columns is
+# given, a flat buffer of cells row after row that is copied as one block.
+# left_probabilities (optional, same layout as grid) is the chance that the
+# ball bounces left off the peg in that cell, pegs are fair (0.5) by default
 class BoardModel:
-    def __init__(self, grid, slot_scores):
-        self.grid = grid
+    def __init__(self, grid, slot_scores, number_of_columns=None, left_probabilities=None):
+        flat = number_of_columns is not None
+        if flat:
+            if number_of_columns <= 0 or len(grid) % number_of_columns != 0:
+                raise ValueError("Cells do not fill whole rows")
+            number_of_rows = len(grid) // number_of_columns
+            self.cells = bytearray(grid)
+        else:
+            number_of_rows = len(grid)
+            number_of_columns = len(grid[0])
+            self.cells = bytearray(number_of_rows * number_of_columns)
+            for row in range(number_of_rows):
+                if len(grid[row]) != number_of_columns:
+                    raise ValueError("All rows must have the same length")
+                self.cells[row * number_of_columns:(row + 1) * number_of_columns] = bytes(grid[row])
+        self.init_board_state(number_of_rows, number_of_columns, slot_scores)
+
+        if left_probabilities is not None:
+            if flat:
+                flat_probabilities = array("d", left_probabilities)
+            else:
+                flat_probabilities = array("d")
+                for row in left_probabilities:
+                    flat_probabilities.extend(row)
+            if len(flat_probabilities) != len(self.cells):
+                raise ValueError("Need one probability per cell")
+            self.left_probabilities = array("d", [0.5]) * len(self.cells)
+            for row, column in self.get_pegs():
+                index = row * self.number_of_columns + column
+                check_probability(flat_probabilities[index])
+                self.left_probabilities[index] = flat_probabilities[index]
+
+# the state every board has, however it stores its pegs, subclasses call
+# this instead of BoardModel.__init__
+    def init_board_state(self, number_of_rows, number_of_columns, slot_scores):
         self.slot_scores = slot_scores
-        self.number_of_rows = len(grid)
-        self.number_of_columns = len(grid[0])
+        self.number_of_rows = number_of_rows
+        self.number_of_columns = number_of_columns
+        self.grid = GridRows(self)
+        # next_peg_below[row * number_of_columns + column] is the first row at or
+        # below row that has a peg in this column, number_of_rows means the slot
+        self.next_peg_below = None
+        # XOR of cell_hash over all pegs, computed on the first fingerprint()
+        self.peg_hash = None
+        self.listeners = []
+        # left probabilities, only created when the board has biased pegs so
+        # fair boards pay nothing for them (one float per cell on this board,
+        # cells without a peg always hold 0.5)
+        self.left_probabilities = None
+        # XOR of probability_hash over the biased pegs, like peg_hash
+        self.bias_hash = None
 
     def in_bounds(self, row, column):
         return 0 <= row < self.number_of_rows and 0 <= column < self.number_of_columns
 
+    def row_view(self, row):
+        if not (0 <= row < self.number_of_rows):
+            raise ValueError("Invalid row")
+        columns = self.number_of_columns
+        return memoryview(self.cells)[row * columns:(row + 1) * columns].toreadonly()
+
 # check the boundry and read or write the value, the value should be either EMPTY or PEG
 
     def get_cell(self, row, column):
         if not self.in_bounds(row, column):
             raise ValueError("Out of bounds")
-        return self.grid[row][column]
+        return self.cells[row * self.number_of_columns + column]
 
     def set_cell(self, row, column, value):
         if not self.in_bounds(row, column):
             raise ValueError("Out of bounds")
         if value != EMPTY and value != PEG:
             raise ValueError("Invalid value")
-        self.grid[row][column] = value
+        index = row * self.number_of_columns + column
+        if self.cells[index] == value:
+            return
+        if self.peg_hash is not None:
+            self.peg_hash ^= cell_hash(index)
+        self.cells[index] = value
+        # a new or removed peg is fair again
+        if self.left_probabilities is not None:
+            old_probability = self.left_probabilities[index]
+            if self.bias_hash is not None and old_probability != 0.5:
+                self.bias_hash ^= probability_hash(index, old_probability)
+            self.left_probabilities[index] = 0.5
+        if self.next_peg_below is not None:
+            self.update_next_peg_below(row, column)
+        self.notify_listeners(row, column, value)
+
+# listeners are called as listener(row, column, value) after every set_cell
+# that really changes a cell, once the board and its indexes are up to date
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def notify_listeners(self, row, column, value):
+        for listener in self.listeners[:]:
+            listener(row, column, value)
+
+    def has_biased_pegs(self):
+        return self.left_probabilities is not None
+
+    def get_left_probability(self, row, column):
+        if self.left_probabilities is None:
+            return 0.5
+        return self.left_probabilities[row * self.number_of_columns + column]
+
+# changing a peg's bias is reported to the listeners like set_cell(row, column, PEG)
+    def set_left_probability(self, row, column, probability):
+        if not self.is_peg(row, column):
+            raise ValueError("There is no peg at this position")
+        check_probability(probability)
+        if self.left_probabilities is None:
+            if probability == 0.5:
+                return
+            self.left_probabilities = array("d", [0.5]) * len(self.cells)
+        index = row * self.number_of_columns + column
+        self.replace_left_probability(index, self.left_probabilities, index, probability)
+        self.notify_listeners(row, column, PEG)
+
+# writes probabilities[position] and keeps bias_hash up to date, index is the
+# cell index row * number_of_columns + column used for hashing
+    def replace_left_probability(self, index, probabilities, position, probability):
+        old_probability = probabilities[position]
+        if self.bias_hash is not None:
+            if old_probability != 0.5:
+                self.bias_hash ^= probability_hash(index, old_probability)
+            if probability != 0.5:
+                self.bias_hash ^= probability_hash(index, probability)
+        probabilities[position] = probability
 
     def is_peg(self, row, column):
-        return self.in_bounds(row, column) and self.grid[row][column] == PEG
+        return self.in_bounds(row, column) and self.cells[row * self.number_of_columns + column] == PEG
 
     def is_empty(self, row, column):
-        return self.in_bounds(row, column) and self.grid[row][column] == EMPTY
-# collects all peg positions on the board  
+        return self.in_bounds(row, column) and self.cells[row * self.number_of_columns + column] == EMPTY
+# collects all peg positions on the board, bytearray.find skips the empty
+# cells in C so only the pegs cost a Python step
     def get_pegs(self):
         result = []
-        for row in range(self.number_of_rows):
-            for column in range(self.number_of_columns):
-                if self.grid[row][column] == PEG:
-                    result.append((row, column))
+        cells = self.cells
+        columns = self.number_of_columns
+        index = cells.find(PEG)
+        while index != -1:
+            result.append(divmod(index, columns))
+            index = cells.find(PEG, index + 1)
         return result
+
+# peg columns of one row, only those left of end_column when it is given
+    def get_pegs_in_row(self, row, end_column=None):
+        result = []
+        cells = self.cells
+        base = row * self.number_of_columns
+        end = base + self.number_of_columns
+        if end_column is not None:
+            end = base + end_column
+        index = cells.find(PEG, base, end)
+        while index != -1:
+            result.append(index - base)
+            index = cells.find(PEG, index + 1, end)
+        return result
+
+    def count_pegs(self):
+        return self.cells.count(PEG)
+
+# left probabilities of the pegs of a row, in the order of get_pegs_in_row
+    def get_left_probabilities_in_row(self, row, peg_columns):
+        if self.left_probabilities is None:
+            return [0.5] * len(peg_columns)
+        base = row * self.number_of_columns
+        return [self.left_probabilities[base + column] for column in peg_columns]
+
+# True when every row equals its reverse and every biased peg bounces left as
+# often as its mirror peg bounces right, one reversed byte comparison per row
+    def has_mirrored_pegs(self):
+        biased = self.has_biased_pegs()
+        for row in range(self.number_of_rows):
+            cells = bytes(self.row_view(row))
+            if cells != cells[::-1]:
+                return False
+            if biased:
+                peg_columns = self.get_pegs_in_row(row)
+                left_probabilities = self.get_left_probabilities_in_row(row, peg_columns)
+                if not probabilities_are_mirrored(left_probabilities, 0, len(peg_columns)):
+                    return False
+        return True
+
+# peg positions as numpy arrays, row by row: the pegs of row r are
+# peg_columns[row_offsets[r]:row_offsets[r + 1]], scanned from the cell buffer
+    def get_peg_index_arrays(self):
+        if numpy is None:
+            raise RuntimeError("Peg index arrays need numpy installed")
+        cells = numpy.frombuffer(self.cells, dtype=numpy.uint8)
+        peg_cells = numpy.flatnonzero(cells == PEG)
+        peg_rows, peg_columns = numpy.divmod(peg_cells, self.number_of_columns)
+        row_offsets = numpy.searchsorted(peg_rows, numpy.arange(self.number_of_rows + 1))
+        return row_offsets, peg_columns
+
+# left probabilities lined up with the peg_columns of get_peg_index_arrays
+    def get_peg_probability_array(self):
+        if numpy is None:
+            raise RuntimeError("Peg probability arrays need numpy installed")
+        cells = numpy.frombuffer(self.cells, dtype=numpy.uint8)
+        left_probabilities = numpy.frombuffer(self.left_probabilities, dtype=numpy.float64)
+        return left_probabilities[cells == PEG]
 # return the list of scores at the botton rows 
     def get_slot_scores(self):
         return self.slot_scores[:]
@@ -46,15 +276,49 @@ class BoardModel:
         if not (0 <= column < self.number_of_columns):
             raise ValueError("Invalid column")
         return self.slot_scores[column]
+
+# (rows, columns, hash of the pegs, slot scores): equal fingerprints mean the
+# same board, set_cell keeps the peg part current with one XOR per change
+    def fingerprint(self):
+        if self.peg_hash is None:
+            value = 0
+            columns = self.number_of_columns
+            for row, column in self.get_pegs():
+                value ^= cell_hash(row * columns + column)
+            self.peg_hash = value
+        if self.bias_hash is None:
+            value = 0
+            if self.has_biased_pegs():
+                columns = self.number_of_columns
+                for row, column in self.get_pegs():
+                    probability = self.get_left_probability(row, column)
+                    if probability != 0.5:
+                        value ^= probability_hash(row * columns + column, probability)
+            self.bias_hash = value
+        return (self.number_of_rows, self.number_of_columns, self.peg_hash, self.bias_hash, tuple(self.slot_scores))
     
-#children can be either another peg node, a slot, or outside the board (None)
+#children can be either another peg node, a slot, or outside the board (None),
+#each is one lookup in the next-peg index (the neighbouring column one row
+#down, the same as child_direction) so nothing per peg is stored
     def get_children_of_peg(self, row, column):
         if not self.is_peg(row, column):
             raise ValueError("There is no peg at this position")
-        # where the ball goes if it bounces left   
-        left_child = self.child_direction(row, column, -1)
-        #where the ball goes if it bounces right
-        right_child = self.child_direction(row, column, 1)
+        if self.next_peg_below is None:
+            self.build_next_peg_below()
+        rows = self.number_of_rows
+        columns = self.number_of_columns
+        below = self.next_peg_below
+        index = (row + 1) * columns + column
+        left_child = None
+        right_child = None
+        if column > 0:
+            left_child = column - 1
+            if row + 1 < rows and below[index - 1] < rows:
+                left_child = (below[index - 1], column - 1)
+        if column + 1 < columns:
+            right_child = column + 1
+            if row + 1 < rows and below[index + 1] < rows:
+                right_child = (below[index + 1], column + 1)
         return left_child, right_child
 
     def child_direction(self, row, column, direction):
@@ -64,17 +328,330 @@ class BoardModel:
         if new_column < 0 or new_column >= self.number_of_columns:
             return None
 
-        if new_row >= self.number_of_rows:
-            return new_column
+        return self.fall_target(new_row, new_column)
+
+# a ball falling down this column from this row hits the next peg, or the slot
+    def fall_target(self, row, column):
+        peg_row = self.next_peg_row(row, column)
+        if peg_row < self.number_of_rows:
+            return (peg_row, column)
+        return column
+
+# first row at or below this row with a peg in the column, number_of_rows if
+# the ball falls all the way to the slot
+    def next_peg_row(self, row, column):
+        if row >= self.number_of_rows:
+            return self.number_of_rows
+        if self.next_peg_below is None:
+            self.build_next_peg_below()
+        return self.next_peg_below[row * self.number_of_columns + column]
+
+    def build_next_peg_below(self):
+        rows = self.number_of_rows
+        columns = self.number_of_columns
+        index = array("i", [rows]) * (rows * columns)
+        below = array("i", [rows]) * columns
+
+        for row in range(rows - 1, -1, -1):
+            for column in self.get_pegs_in_row(row):
+                below[column] = row
+            base = row * columns
+            index[base:base + columns] = below
+
+        self.next_peg_below = index
+
+# only the empty run above the changed cell, up to the previous peg in the
+# column, can point at a different peg
+    def update_next_peg_below(self, row, column):
+        index = self.next_peg_below
+        cells = self.cells
+        columns = self.number_of_columns
+        if cells[row * columns + column] == PEG:
+            target = row
+        else:
+            target = self.next_peg_row(row + 1, column)
+
+        current_row = row
+        while current_row >= 0:
+            index[current_row * columns + column] = target
+            current_row -= 1
+            if current_row >= 0 and cells[current_row * columns + column] == PEG:
+                break
+
+
+# sparse variant for tall, mostly empty boards: only the pegs are stored,
+# row by row as sorted column arrays (CSR style) plus the same pegs column
+# by column as sorted row arrays, so memory grows with the number of pegs
+# and every lookup is a binary search instead of a walk down the board
+class SparseBoardModel(BoardModel):
+    def __init__(self, number_of_rows, number_of_columns, peg_positions, slot_scores, left_probabilities=None):
+        # grid[row] works here too, each access rebuilds the row in row_view
+        self.init_board_state(number_of_rows, number_of_columns, slot_scores)
+
+        peg_list = sorted(set(peg_positions))
+        for row, column in peg_list:
+            if not self.in_bounds(row, column):
+                raise ValueError("Out of bounds")
+
+        # pegs of row r are peg_columns[row_offsets[r]:row_offsets[r + 1]]
+        self.row_offsets = array("i", [0]) * (number_of_rows + 1)
+        self.peg_columns = array("i", [column for row, column in peg_list])
+        for row, column in peg_list:
+            self.row_offsets[row + 1] += 1
+        for row in range(number_of_rows):
+            self.row_offsets[row + 1] += self.row_offsets[row]
+
+        # left_probabilities is a {(row, column): probability} dict, stored as
+        # one float per peg in the same order as peg_columns
+        if left_probabilities:
+            self.left_probabilities = array("d", [0.5]) * len(peg_list)
+            for index in range(len(peg_list)):
+                probability = left_probabilities.get(peg_list[index], 0.5)
+                check_probability(probability)
+                self.left_probabilities[index] = probability
+
+        # pegs of column c are peg_rows[column_offsets[c]:column_offsets[c + 1]]
+        peg_list.sort(key=lambda position: (position[1], position[0]))
+        self.column_offsets = array("i", [0]) * (number_of_columns + 1)
+        self.peg_rows = array("i", [row for row, column in peg_list])
+        for row, column in peg_list:
+            self.column_offsets[column + 1] += 1
+        for column in range(number_of_columns):
+            self.column_offsets[column + 1] += self.column_offsets[column]
+
+    def find_in_row(self, row, column):
+        start = self.row_offsets[row]
+        end = self.row_offsets[row + 1]
+        index = bisect_left(self.peg_columns, column, start, end)
+        return index, index < end and self.peg_columns[index] == column
+
+    def get_cell(self, row, column):
+        if not self.in_bounds(row, column):
+            raise ValueError("Out of bounds")
+        return PEG if self.find_in_row(row, column)[1] else EMPTY
+
+# adding or removing a peg shifts the arrays, so an edit is O(P + R + C),
+# fine for tuning a layout but the board is meant to be built once
+    def set_cell(self, row, column, value):
+        if not self.in_bounds(row, column):
+            raise ValueError("Out of bounds")
+        if value != EMPTY and value != PEG:
+            raise ValueError("Invalid value")
+        index, found = self.find_in_row(row, column)
+        if found == (value == PEG):
+            return
+
+        start = self.column_offsets[column]
+        end = self.column_offsets[column + 1]
+        column_index = bisect_left(self.peg_rows, row, start, end)
+        if self.peg_hash is not None:
+            self.peg_hash ^= cell_hash(row * self.number_of_columns + column)
+        if value == PEG:
+            self.peg_columns.insert(index, column)
+            self.peg_rows.insert(column_index, row)
+            if self.left_probabilities is not None:
+                self.left_probabilities.insert(index, 0.5)
+            step = 1
+        else:
+            del self.peg_columns[index]
+            del self.peg_rows[column_index]
+            if self.left_probabilities is not None:
+                self.replace_left_probability(row * self.number_of_columns + column, self.left_probabilities, index, 0.5)
+                del self.left_probabilities[index]
+            step = -1
+        for later_row in range(row + 1, self.number_of_rows + 1):
+            self.row_offsets[later_row] += step
+        for later_column in range(column + 1, self.number_of_columns + 1):
+            self.column_offsets[later_column] += step
+        self.notify_listeners(row, column, value)
+
+    def is_peg(self, row, column):
+        return self.in_bounds(row, column) and self.find_in_row(row, column)[1]
+
+    def is_empty(self, row, column):
+        return self.in_bounds(row, column) and not self.find_in_row(row, column)[1]
+
+    def get_pegs(self):
+        result = []
+        peg_columns = self.peg_columns
+        row_offsets = self.row_offsets
+        for row in range(self.number_of_rows):
+            for index in range(row_offsets[row], row_offsets[row + 1]):
+                result.append((row, peg_columns[index]))
+        return result
+
+    def get_pegs_in_row(self, row, end_column=None):
+        start = self.row_offsets[row]
+        end = self.row_offsets[row + 1]
+        if start == end:
+            return []
+        if end_column is not None:
+            end, found = self.find_in_row(row, end_column)
+        return list(self.peg_columns[start:end])
+
+    def count_pegs(self):
+        return len(self.peg_columns)
+
+    def get_left_probabilities_in_row(self, row, peg_columns):
+        if self.left_probabilities is None:
+            return [0.5] * len(peg_columns)
+        result = []
+        for column in peg_columns:
+            index, found = self.find_in_row(row, column)
+            result.append(self.left_probabilities[index] if found else 0.5)
+        return result
+
+# every column holds the same peg rows as its mirror column, one array slice
+# comparison per column pair (O(C + P), done in C). Biased boards also walk
+# the rows, the pegs of a row are sorted so the mirror pegs line up
+    def has_mirrored_pegs(self):
+        number_of_columns = self.number_of_columns
+        column_offsets = self.column_offsets
+        peg_rows = self.peg_rows
+        for column in range(number_of_columns // 2):
+            mirror_column = number_of_columns - 1 - column
+            rows = peg_rows[column_offsets[column]:column_offsets[column + 1]]
+            if rows != peg_rows[column_offsets[mirror_column]:column_offsets[mirror_column + 1]]:
+                return False
+
+        if self.left_probabilities is None:
+            return True
+        row_offsets = self.row_offsets
+        for row in range(self.number_of_rows):
+            if not probabilities_are_mirrored(self.left_probabilities, row_offsets[row], row_offsets[row + 1]):
+                return False
+        return True
+
+# the arrays are stored in this layout already, so no copy
+    def get_peg_index_arrays(self):
+        if numpy is None:
+            raise RuntimeError("Peg index arrays need numpy installed")
+        row_offsets = numpy.frombuffer(self.row_offsets, dtype=numpy.int32)
+        peg_columns = numpy.frombuffer(self.peg_columns, dtype=numpy.int32)
+        return row_offsets, peg_columns
+
+    def get_peg_probability_array(self):
+        if numpy is None:
+            raise RuntimeError("Peg probability arrays need numpy installed")
+        return numpy.frombuffer(self.left_probabilities, dtype=numpy.float64)
+
+# not zero-copy here, the row is rebuilt from its peg columns
+    def row_view(self, row):
+        if not (0 <= row < self.number_of_rows):
+            raise ValueError("Invalid row")
+        result = bytearray(self.number_of_columns)
+        for column in self.get_pegs_in_row(row):
+            result[column] = PEG
+        return memoryview(result).toreadonly()
+
+    def get_children_of_peg(self, row, column):
+        if not self.is_peg(row, column):
+            raise ValueError("There is no peg at this position")
+        return self.child_direction(row, column, -1), self.child_direction(row, column, 1)
+
+    def get_left_probability(self, row, column):
+        if self.left_probabilities is None:
+            return 0.5
+        index, found = self.find_in_row(row, column)
+        if not found:
+            return 0.5
+        return self.left_probabilities[index]
+
+    def set_left_probability(self, row, column, probability):
+        index, found = self.find_in_row(row, column) if self.in_bounds(row, column) else (0, False)
+        if not found:
+            raise ValueError("There is no peg at this position")
+        check_probability(probability)
+        if self.left_probabilities is None:
+            if probability == 0.5:
+                return
+            self.left_probabilities = array("d", [0.5]) * len(self.peg_columns)
+        self.replace_left_probability(row * self.number_of_columns + column, self.left_probabilities, index, probability)
+        self.notify_listeners(row, column, PEG)
+
+    def next_peg_row(self, row, column):
+        if row >= self.number_of_rows:
+            return self.number_of_rows
+        end = self.column_offsets[column + 1]
+        index = bisect_left(self.peg_rows, row, self.column_offsets[column], end)
+        if index < end:
+            return self.peg_rows[index]
+        return self.number_of_rows
+
+def sparse_board_from_board(board_model):
+    peg_list = board_model.get_pegs()
+    left_probabilities = None
+    if board_model.has_biased_pegs():
+        left_probabilities = {}
+        for row, column in peg_list:
+            left_probabilities[(row, column)] = board_model.get_left_probability(row, column)
+    return SparseBoardModel(board_model.number_of_rows, board_model.number_of_columns,
+                            peg_list, board_model.slot_scores, left_probabilities)
+
+# compact byte form of a board, used to ship boards to other processes:
+# header (format, rows, columns, score type) + slot scores as a packed array,
+# then the cell bytes for a dense board or the peg cell indexes for a sparse one.
+# Boards with biased pegs set BIASED_FLAG in the format byte and append the
+# left probabilities as doubles (one per cell, or one per peg when sparse)
+BOARD_HEADER = struct.Struct("<BIIB")
+DENSE_FORMAT = 0
+SPARSE_FORMAT = 1
+BIASED_FLAG = 2
+
+def serialize_board(board_model):
+    rows = board_model.number_of_rows
+    columns = board_model.number_of_columns
+    slot_scores = board_model.slot_scores
+    if all(type(score) == int for score in slot_scores):
+        score_type = "q"
+    else:
+        score_type = "d"
+    score_bytes = array(score_type, slot_scores).tobytes()
+
+    probability_bytes = b""
+    biased = BIASED_FLAG if board_model.has_biased_pegs() else 0
+    if biased:
+        probability_bytes = board_model.left_probabilities.tobytes()
+
+    if isinstance(board_model, SparseBoardModel):
+        peg_cells = array("i", [row * columns + column for row, column in board_model.get_pegs()])
+        header = BOARD_HEADER.pack(SPARSE_FORMAT | biased, rows, columns, ord(score_type))
+        return header + score_bytes + peg_cells.tobytes() + probability_bytes
 
-        if self.grid[new_row][new_column] == PEG:
-            return (new_row, new_column)
+    header = BOARD_HEADER.pack(DENSE_FORMAT | biased, rows, columns, ord(score_type))
+    return header + score_bytes + bytes(board_model.cells) + probability_bytes
 
-        current_row = new_row
-        while current_row < self.number_of_rows and self.grid[current_row][new_column] == EMPTY:
-            current_row += 1
+def deserialize_board(data):
+    board_format, rows, columns, score_type = BOARD_HEADER.unpack_from(data, 0)
+    score_type = chr(score_type)
+    offset = BOARD_HEADER.size
+    slot_scores = array(score_type)
+    slot_scores.frombytes(data[offset:offset + columns * slot_scores.itemsize])
+    offset = offset + columns * slot_scores.itemsize
+    slot_scores = slot_scores.tolist()
 
-        if current_row < self.number_of_rows:
-            return (current_row, new_column)
+    biased = board_format & BIASED_FLAG
+    board_format = board_format & ~BIASED_FLAG
 
-        return new_column
\ No newline at end of file
+    if board_format == SPARSE_FORMAT:
+        peg_cells = array("i")
+        if biased:
+            # 4 bytes of cell index plus 8 bytes of probability per peg
+            peg_count = (len(data) - offset) // (peg_cells.itemsize + 8)
+            peg_cells.frombytes(data[offset:offset + peg_count * peg_cells.itemsize])
+        else:
+            peg_cells.frombytes(data[offset:])
+        peg_positions = [divmod(cell, columns) for cell in peg_cells]
+        left_probabilities = None
+        if biased:
+            probabilities = array("d")
+            probabilities.frombytes(data[offset + len(peg_cells) * peg_cells.itemsize:])
+            left_probabilities = dict(zip(peg_positions, probabilities))
+        return SparseBoardModel(rows, columns, peg_positions, slot_scores, left_probabilities)
+    if board_format != DENSE_FORMAT:
+        raise ValueError("Unknown board format")
+    left_probabilities = None
+    if biased:
+        left_probabilities = array("d")
+        left_probabilities.frombytes(data[offset + rows * columns:])
+    return BoardModel(data[offset:offset + rows * columns], slot_scores, columns, left_probabilities)
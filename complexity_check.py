@@ -0,0 +1,253 @@
+import argparse
+import math
+import os
+import re
+import sys
+import time
+import benchmark
+
+COMPLEXITY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "time_complexity.txt")
+
+#the sentence of every checked function's entry in time_complexity.txt that
+#states its bound, quoted word for word (read_documented_bounds fails when
+#the file no longer says so). The allowed exponents are worked out from the
+#O(...) in it. The operation count sees Python work only, so get_pegs is held
+#to its Python level bound, its O(R·C) scan of empty cells runs in C
+DOCUMENTED_BOUNDS = {
+    "get_pegs": "the Python-level work is O(P)",
+    "child_direction": "plus basic bounds checks → O(1)",
+    "build_graph": "Overall worst-case complexity: O(R·C + P + R·C)",
+    "compute_expected_values": "Total complexity: O(R + C + P)",
+    "choose_best_column": "O(R + C + P) with the default sweep",
+    "simulate_fall": "so a drop costs O(k)",
+}
+
+#how each symbol of a bound grows with the swept parameters: P = density * R * C
+#pegs, and a fall visits k pegs with k <= R, about one peg every 1 / density
+#rows until the pegs are dense enough to hit one on every row
+SYMBOL_EXPONENTS = {
+    "1": {"rows": 0, "columns": 0, "density": 0},
+    "R": {"rows": 1, "columns": 0, "density": 0},
+    "C": {"rows": 0, "columns": 1, "density": 0},
+    "P": {"rows": 1, "columns": 1, "density": 1},
+    "k": {"rows": 1, "columns": 0, "density": 1},
+}
+
+#every sweep is (name, parameter, values, fixed parameters): it changes one
+#parameter and keeps the others at BASE_PARAMETERS, updated with the fixed
+#ones. On a nearly empty board the empty runs in a column grow with R, which
+#is where a walk down the column instead of an index lookup shows up
+BASE_PARAMETERS = {"rows": 400, "columns": 100, "density": 0.3}
+SPARSE_DENSITY = 0.005
+SWEEPS = [
+    ("rows", "rows", [100, 200, 400, 800, 1600], {}),
+    ("columns", "columns", [25, 50, 100, 200, 400], {}),
+    ("density", "density", [0.005, 0.02, 0.05, 0.1, 0.2, 0.4, 0.8], {}),
+    ("rows, sparse", "rows", [100, 200, 400, 800, 1600], {"density": SPARSE_DENSITY}),
+]
+QUICK_SWEEPS = [
+    ("rows", "rows", [100, 200, 400], {}),
+    ("columns", "columns", [25, 50, 100], {}),
+    ("density", "density", [0.005, 0.05, 0.4], {}),
+    ("rows, sparse", "rows", [100, 200, 400], {"density": SPARSE_DENSITY}),
+]
+
+#how far the fitted operation-count exponent may go over its bound before
+#it is reported, well above the fitting error of the counts (about 0.05)
+EXPONENT_TOLERANCE = 0.3
+
+
+#{parameter: highest allowed exponent} of a bound such as "O(R + C + P)" or
+#"O(R·C)": a product adds the exponents of its symbols, a sum takes the
+#largest term
+def bound_exponents(bound_text):
+    if not (bound_text.startswith("O(") and bound_text.endswith(")")):
+        raise ValueError("Not a bound: " + bound_text)
+    result = {"rows": 0, "columns": 0, "density": 0}
+    for term in bound_text[2:-1].split("+"):
+        term_exponents = {"rows": 0, "columns": 0, "density": 0}
+        for symbol in term.replace("*", "·").split("·"):
+            symbol = symbol.strip()
+            if symbol not in SYMBOL_EXPONENTS:
+                raise ValueError("Unknown symbol in bound: " + bound_text)
+            for parameter in term_exponents:
+                term_exponents[parameter] = term_exponents[parameter] + SYMBOL_EXPONENTS[symbol][parameter]
+        for parameter in result:
+            result[parameter] = max(result[parameter], term_exponents[parameter])
+    return result
+
+
+#the entry of a function in time_complexity.txt: the first unindented line
+#whose label (the names before the first ':') lists it, plus the '- ' lines
+#under it
+def find_documented_entry(lines, function_name):
+    for index in range(len(lines)):
+        line = lines[index]
+        if line.startswith("-") or ":" not in line:
+            continue
+        names = [name.strip() for name in line.split(":", 1)[0].split(",")]
+        if function_name not in names:
+            continue
+        entry = [line]
+        for next_line in lines[index + 1:]:
+            if not next_line.startswith("- "):
+                break
+            entry.append(next_line)
+        return "\n".join(entry)
+    return None
+
+
+#{function: (bound text, {parameter: allowed exponent})} for DOCUMENTED_BOUNDS,
+#after checking that every quoted sentence is still in the function's entry
+def read_documented_bounds(path=COMPLEXITY_FILE):
+    with open(path, encoding="utf-8") as complexity_file:
+        lines = complexity_file.read().splitlines()
+    bounds = {}
+    for function_name, sentence in DOCUMENTED_BOUNDS.items():
+        entry = find_documented_entry(lines, function_name)
+        if entry is None:
+            raise ValueError(function_name + " has no entry in " + path)
+        if sentence not in entry:
+            raise ValueError(function_name + " is no longer documented as '" + sentence + "' in " + path)
+        bound_text = re.search(r"O\([^()]*\)", sentence).group(0)
+        bounds[function_name] = (bound_text, bound_exponents(bound_text))
+    return bounds
+
+
+#deterministic operation count of one run of function: every Python line
+#executed (so loops without calls count too), every Python function call and
+#return, and every call into C. It does not depend on the machine's load
+def count_operations(function):
+    counter = [0]
+
+    def tracer(frame, event, argument):
+        counter[0] = counter[0] + 1
+        return tracer
+
+    def profiler(frame, event, argument):
+        if event == "c_call":
+            counter[0] = counter[0] + 1
+
+    sys.setprofile(profiler)
+    sys.settrace(tracer)
+    try:
+        function()
+    finally:
+        sys.settrace(None)
+        sys.setprofile(None)
+    return counter[0]
+
+
+def best_time(function, repeats):
+    result = None
+    for attempt in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start_time
+        if result is None or elapsed < result:
+            result = elapsed
+    return result
+
+
+#least squares slope of log(measurement) against log(parameter), the
+#exponent e of measurement ~ parameter ** e
+def fit_exponent(parameter_values, measurements):
+    xs = [math.log(value) for value in parameter_values]
+    ys = [math.log(max(measurement, 1e-12)) for measurement in measurements]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    numerator = 0.0
+    denominator = 0.0
+    for index in range(len(xs)):
+        numerator = numerator + (xs[index] - mean_x) * (ys[index] - mean_y)
+        denominator = denominator + (xs[index] - mean_x) * (xs[index] - mean_x)
+    return numerator / denominator
+
+
+#runs every sweep on random boards (benchmark.create_random_board) and
+#measures each operation of benchmark.benchmark_operations, returns
+#{(operation, sweep name): (parameter, values, times, operation counts)}
+def run_sweeps(sweeps=None, repeats=3):
+    if sweeps is None:
+        sweeps = SWEEPS
+    measurements = {}
+    for sweep_name, parameter, values, fixed_parameters in sweeps:
+        for value in values:
+            parameters = dict(BASE_PARAMETERS)
+            parameters.update(fixed_parameters)
+            parameters[parameter] = value
+            board_model = benchmark.create_random_board(parameters["rows"], parameters["columns"],
+                                                        parameters["density"])
+            for operation_name, function in benchmark.benchmark_operations(board_model):
+                if operation_name not in DOCUMENTED_BOUNDS:
+                    continue
+                entry = measurements.setdefault((operation_name, sweep_name), (parameter, [], [], []))
+                entry[1].append(value)
+                entry[2].append(best_time(function, repeats))
+                entry[3].append(count_operations(function))
+    return measurements
+
+
+#one row per (operation, sweep) with the fitted exponents and whether the
+#operation count grows faster than the documented bound allows. No bound
+#lets the cost grow as the board gets emptier, so a density exponent below
+#-tolerance is reported too. The time exponent is only reported: wall time
+#on a shared machine moves it by more than the tolerance from run to run,
+#the operation count is deterministic
+def check_exponents(measurements, tolerance=EXPONENT_TOLERANCE, bounds=None):
+    if bounds is None:
+        bounds = read_documented_bounds()
+    rows_of_results = []
+    for (operation_name, sweep_name), (parameter, values, times, counts) in measurements.items():
+        bound_text, allowed_exponents = bounds[operation_name]
+        allowed = allowed_exponents[parameter]
+        time_exponent = fit_exponent(values, times)
+        count_exponent = fit_exponent(values, counts)
+        exceeded = count_exponent > allowed + tolerance
+        if parameter == "density" and count_exponent < -tolerance:
+            exceeded = True
+        rows_of_results.append({
+            "operation": operation_name,
+            "parameter": sweep_name,
+            "bound": bound_text,
+            "allowed_exponent": allowed,
+            "time_exponent": time_exponent,
+            "count_exponent": count_exponent,
+            "exceeded": exceeded,
+        })
+    return rows_of_results
+
+
+def print_exponents(rows_of_results):
+    print("%-24s %-12s %-20s %7s %7s %7s" % ("operation", "sweep", "documented bound", "allowed", "time", "ops"))
+    for result in rows_of_results:
+        print("%-24s %-12s %-20s %7d %7.2f %7.2f  %s" % (result["operation"], result["parameter"], result["bound"],
+                                                       result["allowed_exponent"], result["time_exponent"],
+                                                       result["count_exponent"],
+                                                       "EXCEEDS BOUND" if result["exceeded"] else "ok"))
+
+
+#python complexity_check.py [--quick] [--tolerance 0.3]
+#Returns 1 when the operation count of any function grows faster than
+#time_complexity.txt says, 2 when the bounds are no longer in that file
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check measured growth against time_complexity.txt")
+    parser.add_argument("--quick", action="store_true", help="fewer and smaller boards")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=EXPONENT_TOLERANCE)
+    arguments = parser.parse_args(argv)
+
+    try:
+        bounds = read_documented_bounds()
+    except ValueError as error:
+        print(error)
+        return 2
+    sweeps = QUICK_SWEEPS if arguments.quick else SWEEPS
+    rows_of_results = check_exponents(run_sweeps(sweeps, arguments.repeats), arguments.tolerance, bounds)
+    print_exponents(rows_of_results)
+    if any(result["exceeded"] for result in rows_of_results):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -53,8 +53,8 @@ game_state = "WAIT_CLICK"
 ball_x = 0.0
 ball_y = 0.0
 ball_color = COLOR_HUMAN_BALL
-path_points = []
-path_index = 0
+path_points = iter(()) # upcoming points of the ball, produced while it falls
+target_point = None
 ball_speed = 10.0 # Slightly faster for better feel
 
 last_human_round_score = 0
@@ -138,30 +138,40 @@ def grid_to_pixel(layout, row, column):
     y = layout["board_top"] + (row + 0.5) * layout["cell_size"]
     return x, y
 
-def build_path_points(layout, start_column, path_list, final_slot_column):
-    points = []
+# Turns the events of simulation.iter_fall into points one at a time, so the
+# ball starts moving before the fall is finished. on_landing gets the final
+# slot column (None if the ball left the board) when the fall ends
+def iter_path_points(layout, start_column, fall_events, on_landing):
     # Start slightly above board
-    start_x, start_y = grid_to_pixel(layout, -1, start_column)
-    points.append((start_x, start_y))
-
-    for (r, c) in path_list:
-        x, y = grid_to_pixel(layout, r, c)
-        points.append((x, y))
-
-    if final_slot_column is not None:
-        rows = board_model.number_of_rows
-        # Drop into the slot visually
-        x_slot, y_slot = grid_to_pixel(layout, rows, final_slot_column)
-        points.append((x_slot, y_slot))
-        # Add a small bounce at the bottom
-        points.append((x_slot, y_slot - 5))
-        points.append((x_slot, y_slot))
-
-    return points
+    yield grid_to_pixel(layout, -1, start_column)
+
+    for event in fall_events:
+        if event[0] == "peg":
+            yield grid_to_pixel(layout, event[1], event[2])
+            continue
+
+        final_slot_column = event[1]
+        on_landing(final_slot_column)
+        if final_slot_column is not None:
+            rows = board_model.number_of_rows
+            # Drop into the slot visually
+            x_slot, y_slot = grid_to_pixel(layout, rows, final_slot_column)
+            yield (x_slot, y_slot)
+            # Add a small bounce at the bottom
+            yield (x_slot, y_slot - 5)
+            yield (x_slot, y_slot)
+
+def record_human_landing(final_slot_column):
+    global last_human_round_score
+    last_human_round_score = simulation.score_for_slot(board_model, final_slot_column)
+
+def record_ai_landing(final_slot_column):
+    global last_ai_round_score
+    last_ai_round_score = simulation.score_for_slot(board_model, final_slot_column)
 
 def handle_human_click(layout, mouse_x, mouse_y):
     global game_state, ball_x, ball_y, ball_color
-    global path_points, path_index, last_human_round_score
+    global path_points, target_point
 
     if game_state != "WAIT_CLICK":
         return
@@ -183,43 +193,33 @@ def handle_human_click(layout, mouse_x, mouse_y):
     if column >= board_model.number_of_columns: column = board_model.number_of_columns - 1
 
     # Logic
-    path_list, final_slot_column, score_value = simulation.simulate_fall_and_score(
-        board_model, column
-    )
-    last_human_round_score = score_value
-
-    points = build_path_points(layout, column, path_list, final_slot_column)
-    path_points[:] = points
-    path_index = 1
-    ball_x, ball_y = points[0]
+    fall_events = simulation.iter_fall(board_model, column)
+    path_points = iter_path_points(layout, column, fall_events, record_human_landing)
+    ball_x, ball_y = next(path_points)
+    target_point = next(path_points, None)
     ball_color = COLOR_HUMAN_BALL
     game_state = "ANIM_HUMAN"
 
 def start_ai_turn(layout):
     global game_state, ball_x, ball_y, ball_color
-    global path_points, path_index, last_ai_round_score
+    global path_points, target_point
 
     ai_column, _ = graph_dp.choose_best_column(board_model)
-    path_list, final_slot_column, score_value = simulation.simulate_fall_and_score(
-        board_model, ai_column
-    )
-    last_ai_round_score = score_value
-
-    points = build_path_points(layout, ai_column, path_list, final_slot_column)
-    path_points[:] = points
-    path_index = 1
-    ball_x, ball_y = points[0]
+    fall_events = simulation.iter_fall(board_model, ai_column)
+    path_points = iter_path_points(layout, ai_column, fall_events, record_ai_landing)
+    ball_x, ball_y = next(path_points)
+    target_point = next(path_points, None)
     ball_color = COLOR_AI_BALL
     game_state = "ANIM_AI"
 
 def update_animation():
-    global ball_x, ball_y, path_index, game_state
+    global ball_x, ball_y, target_point, game_state
     global human_score, ai_score, round_number
 
     if game_state not in ("ANIM_HUMAN", "ANIM_AI"):
         return
 
-    if path_index >= len(path_points):
+    if target_point is None:
         if game_state == "ANIM_HUMAN":
             human_score += last_human_round_score
             game_state = "AFTER_HUMAN"
@@ -232,7 +232,7 @@ def update_animation():
                 game_state = "WAIT_CLICK"
         return
 
-    target_x, target_y = path_points[path_index]
+    target_x, target_y = target_point
     dx = target_x - ball_x
     dy = target_y - ball_y
     dist = math.hypot(dx, dy)
@@ -240,7 +240,7 @@ def update_animation():
     if dist <= ball_speed:
         ball_x = target_x
         ball_y = target_y
-        path_index += 1
+        target_point = next(path_points, None)
     else:
         ball_x += (dx / dist) * ball_speed
         ball_y += (dy / dist) * ball_speed
@@ -1,6 +1,23 @@
+#numpy is only needed for the "numpy" engine, the game runs without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
 EMPTY = 0
 PEG = 1
 
+#LRU cache of graphs and expected values keyed by the board fingerprint, so
+#the AI does not rebuild everything every round for a board that never changes
+CACHE_SIZE = 32
+result_cache = OrderedDict()
+cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
 def node_for_peg(row, column):
     return ("peg", row, column)
 
@@ -19,25 +36,10 @@ def build_graph(board_model):
         if peg_node not in neighbors:
             neighbors[peg_node] = []
 
-        left_child, right_child = board_model.get_children_of_peg(peg_row, peg_column)
-
-        for child in (left_child, right_child):
-            if child is None:
-                continue
-            #slot child case
-            if type(child) == int:
-                slot_column = child
-                slot_node = node_for_slot(slot_column)
-                if slot_node not in neighbors:
-                    neighbors[slot_node] = []
-                neighbors[peg_node].append((slot_node, 0.5))
-            else:
-                #peg child case
-                child_row, child_column = child
-                child_peg_node = node_for_peg(child_row, child_column)
-                if child_peg_node not in neighbors:
-                    neighbors[child_peg_node] = []
-                neighbors[peg_node].append((child_peg_node, 0.5))
+        for child_node, probability in edges_for_peg(board_model, peg_row, peg_column):
+            if child_node not in neighbors:
+                neighbors[child_node] = []
+            neighbors[peg_node].append((child_node, probability))
 
     number_of_columns = board_model.number_of_columns
 
@@ -50,17 +52,189 @@ def build_graph(board_model):
 
     return neighbors, start_nodes
 
-#go down until you find a peg or reach the bottom
+#edges out of one peg: left child first (with the peg's left probability),
+#then right, sides that leave the board have no edge
+def edges_for_peg(board_model, peg_row, peg_column):
+    edges = []
+    left_child, right_child = board_model.get_children_of_peg(peg_row, peg_column)
+    left_probability = board_model.get_left_probability(peg_row, peg_column)
+
+    for child, probability in ((left_child, left_probability), (right_child, 1.0 - left_probability)):
+        if child is None:
+            continue
+        #slot child case
+        if type(child) == int:
+            edges.append((node_for_slot(child), probability))
+        else:
+            #peg child case
+            child_row, child_column = child
+            edges.append((node_for_peg(child_row, child_column), probability))
+    return edges
+
+#first peg a ball dropped in this column hits, or its slot if the column is empty
 def first_node_for_column(board_model, column):
-    row = 0
-    while row < board_model.number_of_rows and board_model.is_empty(row, column):
-        row = row + 1
+    row = board_model.next_peg_row(0, column)
 
-    if row < board_model.number_of_rows and board_model.is_peg(row, column):
+    if row < board_model.number_of_rows:
         return node_for_peg(row, column)
 
     return node_for_slot(column)
 
+#compact form of the same graph: nodes are integers, pegs 0..P-1 in row
+#major order (so every edge goes to a larger id) and then one slot node per
+#column, P + column. The edges of node i are targets[offsets[i]:offsets[i + 1]]
+#with the matching probabilities, all stored in flat arrays
+class CSRGraph:
+    def __init__(self, number_of_columns, peg_cells, offsets, targets, probabilities, start_ids):
+        self.number_of_columns = number_of_columns
+        #row * number_of_columns + column of every peg, in id order
+        self.peg_cells = peg_cells
+        self.number_of_pegs = len(peg_cells)
+        self.number_of_nodes = self.number_of_pegs + number_of_columns
+        self.offsets = offsets
+        self.targets = targets
+        self.probabilities = probabilities
+        self.start_ids = start_ids
+
+    def node_key(self, node_id):
+        if node_id >= self.number_of_pegs:
+            return node_for_slot(node_id - self.number_of_pegs)
+        row, column = divmod(self.peg_cells[node_id], self.number_of_columns)
+        return node_for_peg(row, column)
+
+    def node_id(self, node):
+        if node[0] == "slot":
+            return self.number_of_pegs + node[1]
+        cell = node[1] * self.number_of_columns + node[2]
+        index = bisect_left(self.peg_cells, cell)
+        if index == self.number_of_pegs or self.peg_cells[index] != cell:
+            raise ValueError("There is no peg at this position")
+        return index
+
+#the chances of bouncing left and right off a peg in this column. By default
+#a side that leaves the board keeps its probability and that mass is lost
+#(the DP rule). With fall_rules a peg with one side off the board sends the
+#ball to its other side every time, as simulate_fall does, which is what
+#happens on every default board (they have pegs in both edge columns)
+def side_probabilities(column, left_probability, number_of_columns, fall_rules=False):
+    if fall_rules:
+        if column == 0 and number_of_columns > 1:
+            return 0.0, 1.0
+        if column + 1 == number_of_columns and column > 0:
+            return 1.0, 0.0
+    return left_probability, 1.0 - left_probability
+
+#builds the CSR graph straight from the board with the same bottom-up sweep
+#as compute_expected_values: below_id[column] is the node a ball falling down
+#that column reaches next, so no tuple keys or dictionaries are created.
+#fall_rules gives the single edge of a peg on the edge probability 1 (see
+#side_probabilities)
+def build_csr_graph(board_model, fall_rules=False):
+    number_of_rows = board_model.number_of_rows
+    number_of_columns = board_model.number_of_columns
+
+    row_columns = []
+    row_start_ids = array("i", [0]) * (number_of_rows + 1)
+    for row in range(number_of_rows):
+        peg_columns = board_model.get_pegs_in_row(row)
+        row_columns.append(peg_columns)
+        row_start_ids[row + 1] = row_start_ids[row] + len(peg_columns)
+    number_of_pegs = row_start_ids[number_of_rows]
+
+    peg_cells = array("i", [0]) * number_of_pegs
+    offsets = array("i", [0]) * (number_of_pegs + number_of_columns + 1)
+    for row in range(number_of_rows):
+        peg_id = row_start_ids[row]
+        for column in row_columns[row]:
+            peg_cells[peg_id] = row * number_of_columns + column
+            edge_count = 0
+            if column > 0:
+                edge_count = edge_count + 1
+            if column + 1 < number_of_columns:
+                edge_count = edge_count + 1
+            offsets[peg_id + 1] = offsets[peg_id] + edge_count
+            peg_id = peg_id + 1
+    for node_id in range(number_of_pegs, number_of_pegs + number_of_columns):
+        offsets[node_id + 1] = offsets[node_id]
+
+    number_of_edges = offsets[number_of_pegs]
+    targets = array("i", [0]) * number_of_edges
+    probabilities = array("d", [0.5]) * number_of_edges
+    below_id = array("i", range(number_of_pegs, number_of_pegs + number_of_columns))
+    biased = board_model.has_biased_pegs()
+    for row in range(number_of_rows - 1, -1, -1):
+        peg_columns = row_columns[row]
+        peg_id = row_start_ids[row]
+        for column in peg_columns:
+            edge = offsets[peg_id]
+            if biased:
+                left_probability = board_model.get_left_probability(row, column)
+            if column > 0:
+                targets[edge] = below_id[column - 1]
+                if biased:
+                    probabilities[edge] = left_probability
+                edge = edge + 1
+            if column + 1 < number_of_columns:
+                targets[edge] = below_id[column + 1]
+                if biased:
+                    probabilities[edge] = 1.0 - left_probability
+            if fall_rules and offsets[peg_id + 1] - offsets[peg_id] == 1:
+                probabilities[offsets[peg_id]] = 1.0
+            peg_id = peg_id + 1
+        peg_id = row_start_ids[row]
+        for column in peg_columns:
+            below_id[column] = peg_id
+            peg_id = peg_id + 1
+
+    return CSRGraph(number_of_columns, peg_cells, offsets, targets, probabilities, below_id)
+
+#converts the dictionary graph from build_graph into a CSRGraph
+def csr_from_graph(neighbors, start_nodes, number_of_columns):
+    peg_nodes = sorted(node for node in neighbors if node[0] == "peg")
+    number_of_pegs = len(peg_nodes)
+    peg_cells = array("i", [node[1] * number_of_columns + node[2] for node in peg_nodes])
+    node_ids = {}
+    for peg_id in range(number_of_pegs):
+        node_ids[peg_nodes[peg_id]] = peg_id
+    for column in range(number_of_columns):
+        node_ids[node_for_slot(column)] = number_of_pegs + column
+
+    offsets = array("i", [0])
+    targets = array("i")
+    probabilities = array("d")
+    for peg_node in peg_nodes:
+        for child_node, probability in neighbors[peg_node]:
+            targets.append(node_ids[child_node])
+            probabilities.append(probability)
+        offsets.append(len(targets))
+    for column in range(number_of_columns):
+        offsets.append(len(targets))
+
+    start_ids = array("i", [node_ids[start_nodes[column]] for column in range(number_of_columns)])
+    return CSRGraph(number_of_columns, peg_cells, offsets, targets, probabilities, start_ids)
+
+#converts a CSRGraph back into (neighbors, start_nodes) exactly as build_graph
+#would return them
+def graph_from_csr(csr_graph):
+    neighbors = {}
+    for peg_id in range(csr_graph.number_of_pegs):
+        peg_node = csr_graph.node_key(peg_id)
+        if peg_node not in neighbors:
+            neighbors[peg_node] = []
+        for edge in range(csr_graph.offsets[peg_id], csr_graph.offsets[peg_id + 1]):
+            child_node = csr_graph.node_key(csr_graph.targets[edge])
+            if child_node not in neighbors:
+                neighbors[child_node] = []
+            neighbors[peg_node].append((child_node, csr_graph.probabilities[edge]))
+
+    start_nodes = {}
+    for column in range(csr_graph.number_of_columns):
+        start_node = csr_graph.node_key(csr_graph.start_ids[column])
+        start_nodes[column] = start_node
+        if start_node not in neighbors:
+            neighbors[start_node] = []
+    return neighbors, start_nodes
+
 def expected_value_for_node(node, board_model, neighbors, expected_value):
     if node in expected_value:
         return expected_value[node]
@@ -86,7 +260,9 @@ def expected_value_for_node(node, board_model, neighbors, expected_value):
     expected_value[node] = total
     return total
 
-def compute_expected_values(board_model):
+#the original top-down version: memoized recursion over the graph, one call
+#per peg along each chain, so very deep boards hit the recursion limit
+def compute_expected_values_recursive(board_model):
     neighbors, start_nodes = build_graph(board_model)
     expected_value = {}
     result_list = []
@@ -101,9 +277,706 @@ def compute_expected_values(board_model):
 
     return result_list
 
+#bottom-up row sweep, no recursion and no dict: below[column] is the expected
+#value of a ball falling down that column just under the current row (the
+#slot score under the last row). A peg's children are whatever a ball falling
+#in the column to its left/right reaches next, which is exactly below[column -/+ 1],
+#so every peg costs two array reads and the values come out the same as the
+#graph DP (same additions in the same order). Biased pegs weight the sides
+#with p and 1 - p, fair boards keep the plain 0.5 loop
+def compute_expected_values(board_model):
+    if is_mirror_symmetric(board_model):
+        return compute_expected_values_mirrored(board_model)
+    below = []
+    for column in range(board_model.number_of_columns):
+        below.append(float(board_model.get_slot_score_at_column(column)))
+    #after the top row, below[column] is the value of dropping in that column
+    return sweep_expected_values(board_model, 0, board_model.number_of_rows, below)
+
+#the sweep over rows start_row..end_row - 1 only: below holds the values just
+#under end_row and is updated in place to the values just above start_row
+def sweep_expected_values(board_model, start_row, end_row, below):
+    number_of_columns = board_model.number_of_columns
+    biased = board_model.has_biased_pegs()
+    for row in range(end_row - 1, start_row - 1, -1):
+        peg_columns = board_model.get_pegs_in_row(row)
+        if not peg_columns:
+            continue
+        #compute the whole row first, pegs in the same row must not see each other
+        row_values = []
+        if biased:
+            left_probabilities = board_model.get_left_probabilities_in_row(row, peg_columns)
+            for index in range(len(peg_columns)):
+                column = peg_columns[index]
+                left_probability = left_probabilities[index]
+                total = 0.0
+                if column > 0:
+                    total = total + left_probability * below[column - 1]
+                if column + 1 < number_of_columns:
+                    total = total + (1.0 - left_probability) * below[column + 1]
+                row_values.append(total)
+        else:
+            for column in peg_columns:
+                total = 0.0
+                if column > 0:
+                    total = total + 0.5 * below[column - 1]
+                if column + 1 < number_of_columns:
+                    total = total + 0.5 * below[column + 1]
+                row_values.append(total)
+        for index in range(len(peg_columns)):
+            below[peg_columns[index]] = row_values[index]
+    return below
+
+#True when the board reads the same left to right and right to left: equal
+#slot scores at mirrored columns, every row equal to its reverse, and every
+#biased peg bouncing left exactly as often as its mirror peg bounces right.
+#The peg part is BoardModel.has_mirrored_pegs, which costs far less than the
+#sweep itself on both kinds of board
+def is_mirror_symmetric(board_model):
+    number_of_columns = board_model.number_of_columns
+    slot_scores = board_model.slot_scores
+    for column in range(number_of_columns // 2):
+        if float(slot_scores[column]) != float(slot_scores[number_of_columns - 1 - column]):
+            return False
+    return board_model.has_mirrored_pegs()
+
+#the row sweep on a mirror symmetric board, over the left half of the
+#columns only (the middle one included): a right child in the other half is
+#read from its mirror column, which holds the same value. A peg and its
+#mirror add the same two products in swapped order, so the result is bit
+#for bit the one of the full sweep with half the pegs visited
+def compute_expected_values_mirrored(board_model):
+    number_of_columns = board_model.number_of_columns
+    half = (number_of_columns + 1) // 2
+    below = []
+    for column in range(half):
+        below.append(float(board_model.get_slot_score_at_column(column)))
+    #every column index a peg of the left half can read, mirrored into it
+    half_column = list(range(half)) + list(range(number_of_columns - 1 - half, -1, -1))
+    biased = board_model.has_biased_pegs()
+
+    for row in range(board_model.number_of_rows - 1, -1, -1):
+        peg_columns = board_model.get_pegs_in_row(row, half)
+        if not peg_columns:
+            continue
+        count = len(peg_columns)
+        row_values = []
+        if biased:
+            left_probabilities = board_model.get_left_probabilities_in_row(row, peg_columns)
+            for index in range(count):
+                column = peg_columns[index]
+                left_probability = left_probabilities[index]
+                total = 0.0
+                if column > 0:
+                    total = total + left_probability * below[column - 1]
+                if column + 1 < number_of_columns:
+                    total = total + (1.0 - left_probability) * below[half_column[column + 1]]
+                row_values.append(total)
+        else:
+            for index in range(count):
+                column = peg_columns[index]
+                total = 0.0
+                if column > 0:
+                    total = total + 0.5 * below[column - 1]
+                if column + 1 < number_of_columns:
+                    total = total + 0.5 * below[half_column[column + 1]]
+                row_values.append(total)
+        for index in range(count):
+            below[peg_columns[index]] = row_values[index]
+
+    for column in range(half, number_of_columns):
+        below.append(below[number_of_columns - 1 - column])
+    return below
+
+#same row sweep as compute_expected_values, but each row is a few array
+#operations: below is padded with a 0 on both sides (falling off the board is
+#worth nothing), so for the peg columns of a row the left children are
+#below[columns] and the right children below[columns + 2]
+def compute_expected_values_numpy(board_model):
+    if numpy is None:
+        raise RuntimeError("The numpy engine needs numpy installed")
+    number_of_columns = board_model.number_of_columns
+    below = numpy.zeros(number_of_columns + 2)
+    below[1:number_of_columns + 1] = [board_model.get_slot_score_at_column(column) for column in range(number_of_columns)]
+
+    row_offsets, peg_columns = board_model.get_peg_index_arrays()
+    rows_with_pegs = numpy.flatnonzero(numpy.diff(row_offsets))
+    if board_model.has_biased_pegs():
+        left_probabilities = board_model.get_peg_probability_array()
+        right_probabilities = 1.0 - left_probabilities
+        for row in rows_with_pegs[::-1]:
+            start = row_offsets[row]
+            end = row_offsets[row + 1]
+            columns = peg_columns[start:end]
+            below[columns + 1] = left_probabilities[start:end] * below[columns] + right_probabilities[start:end] * below[columns + 2]
+    else:
+        for row in rows_with_pegs[::-1]:
+            columns = peg_columns[row_offsets[row]:row_offsets[row + 1]]
+            below[columns + 1] = 0.5 * below[columns] + 0.5 * below[columns + 2]
+
+    return below[1:number_of_columns + 1].tolist()
+
+#expected value of every node of a CSR graph: the ids are in topological
+#order, so one backward loop over a flat array of values is the whole DP
+def compute_node_values_csr(csr_graph, slot_scores):
+    number_of_pegs = csr_graph.number_of_pegs
+    offsets = csr_graph.offsets
+    targets = csr_graph.targets
+    probabilities = csr_graph.probabilities
+    values = array("d", [0.0]) * csr_graph.number_of_nodes
+    for column in range(csr_graph.number_of_columns):
+        values[number_of_pegs + column] = float(slot_scores[column])
+
+    for peg_id in range(number_of_pegs - 1, -1, -1):
+        total = 0.0
+        for edge in range(offsets[peg_id], offsets[peg_id + 1]):
+            total = total + probabilities[edge] * values[targets[edge]]
+        values[peg_id] = total
+    return values
+
+def compute_expected_values_csr(board_model, csr_graph=None):
+    if csr_graph is None:
+        csr_graph = build_csr_graph(board_model)
+    values = compute_node_values_csr(csr_graph, board_model.get_slot_scores())
+    return [values[start_id] for start_id in csr_graph.start_ids]
+
+#full landing distribution for every start column in one forward pass over
+#the graph: mass[node] is a sparse vector {start column: probability that a
+#ball dropped there reaches node}. Node ids are in topological order (every
+#edge goes at least one row down), so a node's vector is complete before it
+#is pushed to its children (one sparse matrix-vector product per peg).
+#Returns distributions[start_column][slot_column] and lost[start_column], the
+#probability that the ball leaves the board instead of reaching a slot. The
+#lost mass follows the rule the graph was built with: the DP rule by default,
+#which differs from the game at pegs in the edge columns, or simulate_fall's
+#with build_csr_graph(board_model, fall_rules=True)
+def compute_landing_distributions_csr(csr_graph):
+    number_of_columns = csr_graph.number_of_columns
+    number_of_pegs = csr_graph.number_of_pegs
+    offsets = csr_graph.offsets
+    targets = csr_graph.targets
+    probabilities = csr_graph.probabilities
+
+    mass = [None] * csr_graph.number_of_nodes
+    for column in range(number_of_columns):
+        start_id = csr_graph.start_ids[column]
+        if mass[start_id] is None:
+            mass[start_id] = {}
+        mass[start_id][column] = 1.0
+
+    lost_list = [0.0] * number_of_columns
+    for peg_id in range(number_of_pegs):
+        vector = mass[peg_id]
+        if vector is None:
+            continue
+        mass[peg_id] = None
+        #only a peg with a side off the board loses mass, a peg with both
+        #children keeps all of it (p + (1 - p) may not add up to exactly 1.0)
+        missing_probability = 0.0
+        if offsets[peg_id + 1] - offsets[peg_id] < 2:
+            missing_probability = 1.0
+            for edge in range(offsets[peg_id], offsets[peg_id + 1]):
+                missing_probability = missing_probability - probabilities[edge]
+        for edge in range(offsets[peg_id], offsets[peg_id + 1]):
+            probability = probabilities[edge]
+            child_id = targets[edge]
+            if mass[child_id] is None:
+                mass[child_id] = {}
+            child_vector = mass[child_id]
+            for start_column, value in vector.items():
+                child_vector[start_column] = child_vector.get(start_column, 0.0) + probability * value
+        #the sides that leave the board
+        if missing_probability > 0.0:
+            for start_column, value in vector.items():
+                lost_list[start_column] = lost_list[start_column] + missing_probability * value
+
+    distributions = []
+    for column in range(number_of_columns):
+        distributions.append([0.0] * number_of_columns)
+    for slot_column in range(number_of_columns):
+        vector = mass[number_of_pegs + slot_column]
+        if vector is None:
+            continue
+        for start_column, value in vector.items():
+            distributions[start_column][slot_column] = value
+
+    return distributions, lost_list
+
+#fall_rules=True gives the distributions of simulate_fall (and of the game)
+def compute_landing_distributions(board_model, fall_rules=False):
+    return compute_landing_distributions_csr(build_csr_graph(board_model, fall_rules))
+
+#exact score distribution of every start column with the same bottom-up row
+#sweep as compute_expected_values, only below[column] is now a probability
+#vector over the distinct slot scores (plus one last entry for leaving the
+#board) instead of a single number, so the sweep costs O(P * S).
+#Returns (score_values, distributions) where distributions[column][i] is the
+#probability of scoring score_values[i] and distributions[column][-1] the
+#probability of falling off the board (which scores 0). The default DP rule
+#loses the off-board side of an edge peg, fall_rules=True gives what
+#simulate_fall_and_score (and the game) produces, see side_probabilities
+def compute_score_distributions(board_model, fall_rules=False):
+    number_of_columns = board_model.number_of_columns
+    slot_scores = board_model.get_slot_scores()
+    score_values = sorted(set(float(score) for score in slot_scores))
+    number_of_scores = len(score_values)
+    score_index = {}
+    for index in range(number_of_scores):
+        score_index[score_values[index]] = index
+
+    below = []
+    for column in range(number_of_columns):
+        vector = [0.0] * (number_of_scores + 1)
+        vector[score_index[float(slot_scores[column])]] = 1.0
+        below.append(vector)
+    off_board = [0.0] * number_of_scores + [1.0]
+
+    for row in range(board_model.number_of_rows - 1, -1, -1):
+        peg_columns = board_model.get_pegs_in_row(row)
+        if not peg_columns:
+            continue
+        left_probabilities = board_model.get_left_probabilities_in_row(row, peg_columns)
+        row_vectors = []
+        for peg_index in range(len(peg_columns)):
+            column = peg_columns[peg_index]
+            left_probability, right_probability = side_probabilities(column, left_probabilities[peg_index],
+                                                                     number_of_columns, fall_rules)
+            left_vector = below[column - 1] if column > 0 else off_board
+            right_vector = below[column + 1] if column + 1 < number_of_columns else off_board
+            vector = []
+            for index in range(number_of_scores + 1):
+                vector.append(left_probability * left_vector[index] + right_probability * right_vector[index])
+            row_vectors.append(vector)
+        for index in range(len(peg_columns)):
+            below[peg_columns[index]] = row_vectors[index]
+
+    return score_values, below
+
+#risk numbers for every start column from the exact score distributions, no
+#sampling: mean, variance, standard deviation, probability of leaving the
+#board, quantiles (smallest score x with P(score <= x) >= q) and tail
+#probabilities P(score >= x) for every threshold (default: every slot score).
+#fall_rules=True describes the game's drops, the default the DP's (see
+#compute_score_distributions)
+def compute_risk_metrics(board_model, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), thresholds=None,
+                         fall_rules=False):
+    score_values, distributions = compute_score_distributions(board_model, fall_rules)
+    if thresholds is None:
+        thresholds = score_values
+
+    metrics_list = []
+    for vector in distributions:
+        #a ball that leaves the board scores 0
+        outcome_probabilities = {}
+        for index in range(len(score_values)):
+            outcome_probabilities[score_values[index]] = vector[index]
+        outcome_probabilities[0.0] = outcome_probabilities.get(0.0, 0.0) + vector[-1]
+        outcomes = sorted(outcome_probabilities.items())
+
+        mean = 0.0
+        for score, probability in outcomes:
+            mean = mean + probability * score
+        variance = 0.0
+        for score, probability in outcomes:
+            variance = variance + probability * (score - mean) * (score - mean)
+
+        quantile_values = {}
+        for quantile in quantiles:
+            cumulative = 0.0
+            quantile_values[quantile] = outcomes[-1][0]
+            for score, probability in outcomes:
+                cumulative = cumulative + probability
+                #small slack so rounding in the sums does not skip a score
+                if cumulative >= quantile - 1e-12:
+                    quantile_values[quantile] = score
+                    break
+
+        tail_probabilities = {}
+        for threshold in thresholds:
+            total = 0.0
+            for score, probability in outcomes:
+                if score >= threshold:
+                    total = total + probability
+            tail_probabilities[threshold] = total
+
+        metrics_list.append({
+            "mean": mean,
+            "variance": variance,
+            "standard_deviation": variance ** 0.5,
+            "lost_probability": vector[-1],
+            "quantiles": quantile_values,
+            "tail_probabilities": tail_probabilities,
+        })
+    return metrics_list
+
+#forward pass: visits[node] = sum over start columns of weight * probability
+#that a ball dropped in that column reaches the node
+def compute_visit_probabilities_csr(csr_graph, column_weights):
+    offsets = csr_graph.offsets
+    targets = csr_graph.targets
+    probabilities = csr_graph.probabilities
+    visits = array("d", [0.0]) * csr_graph.number_of_nodes
+    for column in range(csr_graph.number_of_columns):
+        visits[csr_graph.start_ids[column]] += column_weights[column]
+
+    for peg_id in range(csr_graph.number_of_pegs):
+        value = visits[peg_id]
+        if value == 0.0:
+            continue
+        for edge in range(offsets[peg_id], offsets[peg_id + 1]):
+            visits[targets[edge]] += probabilities[edge] * value
+    return visits
+
+#for every peg, the node a ball reaches when it falls through that peg's cell
+#(as if the peg were removed): the next peg below in the same column or its
+#slot. Same column sweep as build_csr_graph, walking the ids backwards
+def pass_through_ids_csr(csr_graph):
+    number_of_pegs = csr_graph.number_of_pegs
+    number_of_columns = csr_graph.number_of_columns
+    below_id = array("i", range(number_of_pegs, number_of_pegs + number_of_columns))
+    pass_through_ids = array("i", [0]) * number_of_pegs
+    for peg_id in range(number_of_pegs - 1, -1, -1):
+        column = csr_graph.peg_cells[peg_id] % number_of_columns
+        pass_through_ids[peg_id] = below_id[column]
+        below_id[column] = peg_id
+    return pass_through_ids
+
+#adjoint sensitivities of J = sum over columns of column_weights[column] * EV
+#of that column (one-hot weights give one column's EV), from one forward pass
+#(visit probabilities) and one backward pass (node values). For every peg:
+#  removal_effect = change of J if the peg is removed, which is exact: the
+#                   balls that reached the peg now fall on to the node below
+#                   it, and nothing below the peg depends on it
+#  bias_gradient  = dJ/dp for the peg's left bounce probability p
+#Returns {(row, column): (removal_effect, bias_gradient)}
+def compute_peg_sensitivities(board_model, column_weights, csr_graph=None):
+    if csr_graph is None:
+        csr_graph = build_csr_graph(board_model)
+    number_of_columns = csr_graph.number_of_columns
+    if len(column_weights) != number_of_columns:
+        raise ValueError("Need one weight per column")
+    values = compute_node_values_csr(csr_graph, board_model.get_slot_scores())
+    visits = compute_visit_probabilities_csr(csr_graph, column_weights)
+    pass_through_ids = pass_through_ids_csr(csr_graph)
+
+    sensitivities = {}
+    for peg_id in range(csr_graph.number_of_pegs):
+        row, column = divmod(csr_graph.peg_cells[peg_id], number_of_columns)
+        visit = visits[peg_id]
+        removal_effect = visit * (values[pass_through_ids[peg_id]] - values[peg_id])
+
+        #a side that leaves the board is worth 0
+        edge = csr_graph.offsets[peg_id]
+        left_value = 0.0
+        right_value = 0.0
+        if column > 0:
+            left_value = values[csr_graph.targets[edge]]
+            edge = edge + 1
+        if column + 1 < number_of_columns:
+            right_value = values[csr_graph.targets[edge]]
+        sensitivities[(row, column)] = (removal_effect, visit * (left_value - right_value))
+    return sensitivities
+
+#the same for every start column separately: {(row, column): {start column:
+#(removal_effect, bias_gradient)}}, only columns that can reach the peg are
+#listed. This is one weighted pass per column
+def compute_all_peg_sensitivities(board_model):
+    csr_graph = build_csr_graph(board_model)
+    number_of_columns = csr_graph.number_of_columns
+    result = {}
+    for start_column in range(number_of_columns):
+        column_weights = [0.0] * number_of_columns
+        column_weights[start_column] = 1.0
+        sensitivities = compute_peg_sensitivities(board_model, column_weights, csr_graph)
+        for peg_position, effects in sensitivities.items():
+            if peg_position not in result:
+                result[peg_position] = {}
+            if effects[0] != 0.0 or effects[1] != 0.0:
+                result[peg_position][start_column] = effects
+    return result
+
+#absorption matrix of the board: absorption[start_column][slot_column] is the
+#probability of landing in that slot, it only depends on the pegs so it can be
+#reused for any slot scores. graph can be a (neighbors, start_nodes) pair
+#already returned by build_graph / get_graph, otherwise the CSR graph is built
+def compute_absorption_matrix(board_model, graph=None):
+    if graph is None:
+        csr_graph = build_csr_graph(board_model)
+    else:
+        neighbors, start_nodes = graph
+        csr_graph = csr_from_graph(neighbors, start_nodes, board_model.number_of_columns)
+    distributions, lost_list = compute_landing_distributions_csr(csr_graph)
+    return distributions
+
+#expected values of many candidate payouts on the same peg layout with one
+#matrix multiply: result[k][column] = sum over slots of
+#absorption[column][slot] * score_vectors[k][slot] (falling off scores 0)
+def evaluate_score_vectors(absorption_matrix, score_vectors):
+    number_of_columns = len(absorption_matrix)
+    for score_vector in score_vectors:
+        if len(score_vector) != number_of_columns:
+            raise ValueError("Every score vector needs one score per column")
+    if numpy is not None:
+        product = numpy.asarray(score_vectors, dtype=float).reshape(-1, number_of_columns) @ numpy.asarray(absorption_matrix, dtype=float).T
+        return product.tolist()
+
+    result = []
+    for score_vector in score_vectors:
+        row_values = []
+        for column in range(number_of_columns):
+            total = 0.0
+            probabilities = absorption_matrix[column]
+            for slot_column in range(number_of_columns):
+                total = total + probabilities[slot_column] * score_vector[slot_column]
+            row_values.append(total)
+        result.append(row_values)
+    return result
+
+def compute_expected_values_for_scores(board_model, score_vectors, graph=None):
+    return evaluate_score_vectors(compute_absorption_matrix(board_model, graph), score_vectors)
+
+#periodic boards: a ball falling in column c just above row r moves to
+#column c - 1 (probability p) or c + 1 (1 - p) if (r, c) is a peg, and stays
+#in column c otherwise, so rows start_row..end_row - 1 act on the falling
+#column as one C x C matrix:
+#matrix[c][d] = probability that a ball falling in column c above start_row
+#is falling in column d below end_row (rows sum to less than 1 when the ball
+#can leave the board). Built with the same bottom-up sweep, one row vector
+#per column instead of one number, O(P * C). fall_rules as in
+#side_probabilities
+def transition_matrix_for_rows(board_model, start_row, end_row, fall_rules=False):
+    number_of_columns = board_model.number_of_columns
+    below = []
+    for column in range(number_of_columns):
+        vector = [0.0] * number_of_columns
+        vector[column] = 1.0
+        below.append(vector)
+    off_board = [0.0] * number_of_columns
+
+    for row in range(end_row - 1, start_row - 1, -1):
+        peg_columns = board_model.get_pegs_in_row(row)
+        if not peg_columns:
+            continue
+        left_probabilities = board_model.get_left_probabilities_in_row(row, peg_columns)
+        row_vectors = []
+        for peg_index in range(len(peg_columns)):
+            column = peg_columns[peg_index]
+            left_probability, right_probability = side_probabilities(column, left_probabilities[peg_index],
+                                                                     number_of_columns, fall_rules)
+            left_vector = below[column - 1] if column > 0 else off_board
+            right_vector = below[column + 1] if column + 1 < number_of_columns else off_board
+            vector = []
+            for index in range(number_of_columns):
+                vector.append(left_probability * left_vector[index] + right_probability * right_vector[index])
+            row_vectors.append(vector)
+        for index in range(len(peg_columns)):
+            below[peg_columns[index]] = row_vectors[index]
+    return below
+
+def multiply_matrices(first_matrix, second_matrix):
+    if numpy is not None:
+        return (numpy.asarray(first_matrix, dtype=float) @ numpy.asarray(second_matrix, dtype=float)).tolist()
+    size = len(second_matrix)
+    result = []
+    for first_row in first_matrix:
+        row_values = [0.0] * len(second_matrix[0])
+        for index in range(size):
+            factor = first_row[index]
+            if factor == 0.0:
+                continue
+            second_row = second_matrix[index]
+            for column in range(len(row_values)):
+                row_values[column] = row_values[column] + factor * second_row[column]
+        result.append(row_values)
+    return result
+
+#matrix ** exponent by repeated squaring, O(C^3 log exponent)
+def matrix_power(matrix, exponent):
+    size = len(matrix)
+    if numpy is not None:
+        base = numpy.asarray(matrix, dtype=float)
+        result = numpy.identity(size)
+        while exponent > 0:
+            if exponent & 1:
+                result = result @ base
+            exponent = exponent >> 1
+            if exponent:
+                base = base @ base
+        return result.tolist()
+
+    result = []
+    for column in range(size):
+        vector = [0.0] * size
+        vector[column] = 1.0
+        result.append(vector)
+    base = matrix
+    while exponent > 0:
+        if exponent & 1:
+            result = multiply_matrices(result, base)
+        exponent = exponent >> 1
+        if exponent:
+            base = multiply_matrices(base, base)
+    return result
+
+def multiply_matrix_vector(matrix, vector):
+    result = []
+    for matrix_row in matrix:
+        total = 0.0
+        for index in range(len(vector)):
+            total = total + matrix_row[index] * vector[index]
+        result.append(total)
+    return result
+
+#longest run of rows that repeats with a period of at most max_period rows.
+#Every row gets a small id (equal rows, pegs and biases, share an id), then
+#for each period the longest stretch with id[row] == id[row - period] is the
+#periodic section. Returns (start_row, period, repetitions) with at least two
+#full periods, or None when the board has no such section
+def find_row_period(board_model, max_period=8):
+    number_of_rows = board_model.number_of_rows
+    biased = board_model.has_biased_pegs()
+    row_ids = []
+    id_for_key = {}
+    for row in range(number_of_rows):
+        key = bytes(board_model.row_view(row))
+        if biased:
+            peg_columns = board_model.get_pegs_in_row(row)
+            key = (key, tuple(board_model.get_left_probabilities_in_row(row, peg_columns)))
+        if key not in id_for_key:
+            id_for_key[key] = len(id_for_key)
+        row_ids.append(id_for_key[key])
+
+    best = None
+    best_rows = 0
+    for period in range(1, max_period + 1):
+        run_start = period
+        for row in range(period, number_of_rows + 1):
+            if row < number_of_rows and row_ids[row] == row_ids[row - period]:
+                continue
+            #rows run_start..row - 1 repeat the row one period above them
+            repetitions = (row - run_start + period) // period
+            if repetitions >= 2 and repetitions * period > best_rows:
+                best_rows = repetitions * period
+                best = (run_start - period, period, repetitions)
+            run_start = row + 1
+    return best
 
-def choose_best_column(board_model):
-    expected_values_list = compute_expected_values(board_model)
+#expected values using the periodic section: the rows below it are swept as
+#usual, the section itself is one matrix power applied to the values under
+#it, then the rows above are swept. O(P outside the section + P_period * C +
+#C^3 log repetitions), the same values as compute_expected_values up to
+#floating point rounding (the additions happen in a different order)
+def compute_expected_values_periodic(board_model, max_period=8):
+    section = find_row_period(board_model, max_period)
+    if section is None:
+        return compute_expected_values(board_model)
+    start_row, period, repetitions = section
+    end_row = start_row + period * repetitions
+
+    below = []
+    for column in range(board_model.number_of_columns):
+        below.append(float(board_model.get_slot_score_at_column(column)))
+    sweep_expected_values(board_model, end_row, board_model.number_of_rows, below)
+    period_matrix = transition_matrix_for_rows(board_model, start_row, start_row + period)
+    below = multiply_matrix_vector(matrix_power(period_matrix, repetitions), below)
+    return sweep_expected_values(board_model, 0, start_row, below)
+
+#landing distributions from transition matrices: rows above the section,
+#the section as a matrix power, rows below it. lost[column] is whatever
+#probability did not reach a slot
+def compute_landing_distributions_periodic(board_model, max_period=8, fall_rules=False):
+    number_of_rows = board_model.number_of_rows
+    section = find_row_period(board_model, max_period)
+    if section is None:
+        distributions = transition_matrix_for_rows(board_model, 0, number_of_rows, fall_rules)
+    else:
+        start_row, period, repetitions = section
+        end_row = start_row + period * repetitions
+        period_matrix = transition_matrix_for_rows(board_model, start_row, start_row + period, fall_rules)
+        distributions = multiply_matrices(transition_matrix_for_rows(board_model, 0, start_row, fall_rules),
+                                          matrix_power(period_matrix, repetitions))
+        distributions = multiply_matrices(distributions,
+                                          transition_matrix_for_rows(board_model, end_row, number_of_rows,
+                                                                     fall_rules))
+    return distributions, lost_from_distributions(distributions)
+
+def lost_from_distributions(distributions):
+    lost_list = []
+    for distribution in distributions:
+        lost_list.append(max(0.0, 1.0 - sum(distribution)))
+    return lost_list
+
+#an implicit tall board: the rows of pattern_board repeated repetitions times
+#above the pattern board's slots, never built cell by cell. With a period-2
+#stagger and 10^6 rows this is one small matrix raised to the 500000th power
+def compute_expected_values_repeated(pattern_board, repetitions):
+    period_matrix = transition_matrix_for_rows(pattern_board, 0, pattern_board.number_of_rows)
+    slot_values = [float(score) for score in pattern_board.get_slot_scores()]
+    return multiply_matrix_vector(matrix_power(period_matrix, repetitions), slot_values)
+
+def compute_landing_distributions_repeated(pattern_board, repetitions, fall_rules=False):
+    period_matrix = transition_matrix_for_rows(pattern_board, 0, pattern_board.number_of_rows, fall_rules)
+    distributions = matrix_power(period_matrix, repetitions)
+    return distributions, lost_from_distributions(distributions)
+
+EXPECTED_VALUE_ENGINES = {
+    "sweep": compute_expected_values,
+    "csr": compute_expected_values_csr,
+    "numpy": compute_expected_values_numpy,
+    "recursive": compute_expected_values_recursive,
+}
+
+def cached_result(board_model, kind, compute_function):
+    key = (kind, board_model.fingerprint())
+    if key in result_cache:
+        result_cache.move_to_end(key)
+        cache_stats["hits"] = cache_stats["hits"] + 1
+        return result_cache[key]
+
+    cache_stats["misses"] = cache_stats["misses"] + 1
+    value = compute_function(board_model)
+    result_cache[key] = value
+    while len(result_cache) > CACHE_SIZE:
+        result_cache.popitem(last=False)
+        cache_stats["evictions"] = cache_stats["evictions"] + 1
+    return value
+
+#cached build_graph, the returned dictionaries are shared so do not modify them
+def get_graph(board_model):
+    return cached_result(board_model, "graph", build_graph)
+
+#cached expected values (all engines give the same values), returns a copy
+def get_expected_values(board_model, engine="sweep"):
+    if engine not in EXPECTED_VALUE_ENGINES:
+        raise ValueError("Unknown engine")
+    return cached_result(board_model, "expected_values", EXPECTED_VALUE_ENGINES[engine])[:]
+
+def set_cache_size(size):
+    global CACHE_SIZE
+    if size < 1:
+        raise ValueError("Cache size must be at least 1")
+    CACHE_SIZE = size
+    while len(result_cache) > CACHE_SIZE:
+        result_cache.popitem(last=False)
+        cache_stats["evictions"] = cache_stats["evictions"] + 1
+
+def clear_cache():
+    result_cache.clear()
+    for name in cache_stats:
+        cache_stats[name] = 0
+
+def get_cache_stats():
+    stats = dict(cache_stats)
+    stats["size"] = len(result_cache)
+    return stats
+
+def choose_best_column(board_model, engine="sweep", use_cache=True):
+    if engine not in EXPECTED_VALUE_ENGINES:
+        raise ValueError("Unknown engine")
+    if use_cache:
+        expected_values_list = get_expected_values(board_model, engine)
+    else:
+        expected_values_list = EXPECTED_VALUE_ENGINES[engine](board_model)
     best_column = 0
     best_value = expected_values_list[0]
 
@@ -112,4 +985,120 @@ def choose_best_column(board_model):
             best_value = expected_values_list[column]
             best_column = column
 
-    return best_column, best_value
\ No newline at end of file
+    return best_column, best_value
+
+#keeps the graph and the expected value of every node alive while a board is
+#being edited. It listens to set_cell, rewires only the edges that the edit
+#touched and then recomputes, bottom-up, just those pegs and the ancestors
+#whose value really changed, instead of solving the whole board again
+class IncrementalExpectedValues:
+    def __init__(self, board_model):
+        self.board_model = board_model
+        self.neighbors, self.start_nodes = build_graph(board_model)
+        self.parents = {}
+        for node, edge_list in self.neighbors.items():
+            for child_node, probability in edge_list:
+                self.add_parent(child_node, node)
+
+        #expected value of every peg node, filled from the bottom row up
+        self.expected_value = {}
+        peg_nodes = sorted((node for node in self.neighbors if node[0] == "peg"), reverse=True)
+        for peg_node in peg_nodes:
+            self.expected_value[peg_node] = self.value_from_children(peg_node)
+
+        #heap of (-row, column) of pegs waiting to be recomputed
+        self.dirty_heap = []
+        self.dirty_set = set()
+        self.recomputed_count = 0
+        board_model.add_listener(self.cell_changed)
+
+    def add_parent(self, child_node, parent_node):
+        if child_node not in self.parents:
+            self.parents[child_node] = set()
+        self.parents[child_node].add(parent_node)
+
+    def node_value(self, node):
+        if node[0] == "slot":
+            return float(self.board_model.get_slot_score_at_column(node[1]))
+        return self.expected_value[node]
+
+    def value_from_children(self, peg_node):
+        total = 0.0
+        for child_node, probability in self.neighbors[peg_node]:
+            total = total + probability * self.node_value(child_node)
+        return total
+
+    def mark_dirty(self, peg_node):
+        if peg_node not in self.dirty_set:
+            self.dirty_set.add(peg_node)
+            heapq.heappush(self.dirty_heap, (-peg_node[1], peg_node[2]))
+
+    def set_edges(self, peg_node, edge_list):
+        for child_node, probability in self.neighbors.get(peg_node, []):
+            if child_node in self.parents:
+                self.parents[child_node].discard(peg_node)
+        self.neighbors[peg_node] = edge_list
+        for child_node, probability in edge_list:
+            if child_node not in self.neighbors:
+                self.neighbors[child_node] = []
+            self.add_parent(child_node, peg_node)
+        self.mark_dirty(peg_node)
+
+    #called by the board after set_cell changed (row, column)
+    def cell_changed(self, row, column, value):
+        board_model = self.board_model
+        peg_node = node_for_peg(row, column)
+        if value == PEG:
+            self.set_edges(peg_node, edges_for_peg(board_model, row, column))
+        else:
+            for child_node, probability in self.neighbors.pop(peg_node, []):
+                self.parents[child_node].discard(peg_node)
+            self.parents.pop(peg_node, None)
+            self.expected_value.pop(peg_node, None)
+
+        #pegs beside this column, from the previous peg above down to this
+        #row, look through this cell so their children may have changed
+        current_row = row - 1
+        while current_row >= 0:
+            for side_column in (column - 1, column + 1):
+                if board_model.is_peg(current_row, side_column):
+                    self.set_edges(node_for_peg(current_row, side_column),
+                                   edges_for_peg(board_model, current_row, side_column))
+            if board_model.is_peg(current_row, column):
+                break
+            current_row = current_row - 1
+
+        start_node = first_node_for_column(board_model, column)
+        self.start_nodes[column] = start_node
+        if start_node not in self.neighbors:
+            self.neighbors[start_node] = []
+
+    #recomputes the dirty pegs from the bottom up (children always sit in
+    #lower rows, so they are final when a peg is popped) and only passes the
+    #change on to the parents when a value actually changed
+    def update(self):
+        while self.dirty_heap:
+            negative_row, column = heapq.heappop(self.dirty_heap)
+            peg_node = node_for_peg(-negative_row, column)
+            self.dirty_set.discard(peg_node)
+            if peg_node not in self.neighbors:
+                continue
+            value = self.value_from_children(peg_node)
+            self.recomputed_count = self.recomputed_count + 1
+            if self.expected_value.get(peg_node) != value:
+                self.expected_value[peg_node] = value
+                for parent_node in self.parents.get(peg_node, ()):
+                    self.mark_dirty(parent_node)
+        return self.expected_values()
+
+    def expected_values(self):
+        if self.dirty_heap:
+            return self.update()
+        result_list = []
+        for column in range(self.board_model.number_of_columns):
+            result_list.append(self.node_value(self.start_nodes[column]))
+        return result_list
+
+    #stop listening to the board
+    def close(self):
+        self.board_model.remove_listener(self.cell_changed)
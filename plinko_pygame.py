@@ -49,8 +49,8 @@ game_state = "WAIT_CLICK"
 ball_x = 0.0
 ball_y = 0.0
 ball_color = COLOR_HUMAN_BALL
-path_points = []
-path_index = 0
+path_points = iter(())
+target_point = None
 ball_speed = 8.0
 
 last_human_round_score = 0
@@ -150,32 +150,38 @@ def grid_to_pixel(layout, row, column):
     return x, y
 
 
-def build_path_points(layout, start_column, path_list, final_slot_column):
-    points = []
+#turns the events of simulation.iter_fall into points one at a time, so the
+#ball starts moving before the fall is finished and no path list is kept.
+#on_landing gets the final slot column (None if the ball left the board)
+def iter_path_points(layout, start_column, fall_events, on_landing):
+    yield grid_to_pixel(layout, -1, start_column)
+
+    for event in fall_events:
+        if event[0] == "peg":
+            yield grid_to_pixel(layout, event[1], event[2])
+        else:
+            final_slot_column = event[1]
+            on_landing(final_slot_column)
+            if final_slot_column is not None:
+                rows = board_model.number_of_rows
+                gap_rows = layout["gap_rows"]
+                slot_row = rows + gap_rows
+                yield grid_to_pixel(layout, slot_row, final_slot_column)
 
-    start_x, start_y = grid_to_pixel(layout, -1, start_column)
-    points.append((start_x, start_y))
 
-    index = 0
-    while index < len(path_list):
-        row, column = path_list[index]
-        x, y = grid_to_pixel(layout, row, column)
-        points.append((x, y))
-        index = index + 1
+def record_human_landing(final_slot_column):
+    global last_human_round_score
+    last_human_round_score = simulation.score_for_slot(board_model, final_slot_column)
 
-    if final_slot_column is not None:
-        rows = board_model.number_of_rows
-        gap_rows = layout["gap_rows"]
-        slot_row = rows + gap_rows
-        x_slot, y_slot = grid_to_pixel(layout, slot_row, final_slot_column)
-        points.append((x_slot, y_slot))
 
-    return points
+def record_ai_landing(final_slot_column):
+    global last_ai_round_score
+    last_ai_round_score = simulation.score_for_slot(board_model, final_slot_column)
 
 
 def handle_human_click(layout, mouse_x, mouse_y):
     global game_state, ball_x, ball_y, ball_color
-    global path_points, path_index, last_human_round_score
+    global path_points, target_point
 
     if game_state != "WAIT_CLICK":
         return
@@ -197,45 +203,35 @@ def handle_human_click(layout, mouse_x, mouse_y):
     if column < 0 or column >= board_model.number_of_columns:
         return
 
-    path_list, final_slot_column, score_value = simulation.simulate_fall_and_score(
-        board_model, column
-    )
-    last_human_round_score = score_value
-
-    points = build_path_points(layout, column, path_list, final_slot_column)
-    path_points[:] = points
-    path_index = 1
-    ball_x, ball_y = points[0]
+    fall_events = simulation.iter_fall(board_model, column)
+    path_points = iter_path_points(layout, column, fall_events, record_human_landing)
+    ball_x, ball_y = next(path_points)
+    target_point = next(path_points, None)
     ball_color = COLOR_HUMAN_BALL
     globals()["game_state"] = "ANIM_HUMAN"
 
 
 def start_ai_turn(layout):
     global game_state, ball_x, ball_y, ball_color
-    global path_points, path_index, last_ai_round_score
+    global path_points, target_point
 
     ai_column, ai_expected_value = graph_dp.choose_best_column(board_model)
-    path_list, final_slot_column, score_value = simulation.simulate_fall_and_score(
-        board_model, ai_column
-    )
-    last_ai_round_score = score_value
-
-    points = build_path_points(layout, ai_column, path_list, final_slot_column)
-    path_points[:] = points
-    path_index = 1
-    ball_x, ball_y = points[0]
+    fall_events = simulation.iter_fall(board_model, ai_column)
+    path_points = iter_path_points(layout, ai_column, fall_events, record_ai_landing)
+    ball_x, ball_y = next(path_points)
+    target_point = next(path_points, None)
     ball_color = COLOR_AI_BALL
     globals()["game_state"] = "ANIM_AI"
 
 
 def update_animation():
-    global ball_x, ball_y, path_index, game_state
+    global ball_x, ball_y, target_point, game_state
     global human_score, ai_score, round_number
 
     if game_state not in ("ANIM_HUMAN", "ANIM_AI"):
         return
 
-    if path_index >= len(path_points):
+    if target_point is None:
         if game_state == "ANIM_HUMAN":
             human_score = human_score + last_human_round_score
             globals()["game_state"] = "AFTER_HUMAN"
@@ -248,7 +244,7 @@ def update_animation():
                 globals()["game_state"] = "WAIT_CLICK"
         return
 
-    target_x, target_y = path_points[path_index]
+    target_x, target_y = target_point
     dx = target_x - ball_x
     dy = target_y - ball_y
     distance_sq = dx * dx + dy * dy
@@ -256,11 +252,11 @@ def update_animation():
     if distance_sq <= ball_speed * ball_speed:
         ball_x = target_x
         ball_y = target_y
-        path_index = path_index + 1
+        target_point = next(path_points, None)
     else:
         distance = distance_sq ** 0.5
         if distance == 0:
-            path_index = path_index + 1
+            target_point = next(path_points, None)
             return
         step_x = ball_speed * dx / distance
         step_y = ball_speed * dy / distance
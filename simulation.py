@@ -1,35 +1,52 @@
+#numpy is only needed for the batch simulations, the game runs without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import random
+import time
+from statistics import NormalDist
+import graph_dp
 
 def first_peg_position_for_column(board_model, column):
     if column < 0 or column >= board_model.number_of_columns:
         raise ValueError("Column is out of bounds")
-    row = 0
-    #move down until we find a peg or reach the bottom
-    while row < board_model.number_of_rows and board_model.is_empty(row, column):
-        row = row + 1
-    if row < board_model.number_of_rows and board_model.is_peg(row, column):
+    #the board keeps the next peg below every cell, so no need to walk down
+    row = board_model.next_peg_row(0, column)
+    if row < board_model.number_of_rows:
         return (row, column)
     return None
 
-def simulate_fall(board_model, start_column):
+#generator is anything with a random() method (the random module or a
+#random.Random), pass a seeded random.Random for reproducible drops.
+#Yields ("peg", row, column) for every peg as soon as the ball reaches it,
+#then one ("slot", final_slot_column) event, final_slot_column being None
+#when the ball leaves the board. Nothing is kept of the pegs already passed
+def iter_fall(board_model, start_column, generator=random):
     position = first_peg_position_for_column(board_model, start_column)
-    path_list = [] #store all the pegs the ball touches
 
     if position is None:
-        final_slot_column = start_column
-        return path_list, final_slot_column
+        yield ("slot", start_column)
+        return
 
     current_row, current_column = position
-    path_list.append((current_row, current_column))
+    #fair boards skip the per-peg lookup
+    biased = board_model.has_biased_pegs()
+    left_probability = 0.5
 
     while True:
+        yield ("peg", current_row, current_column)
         left_child, right_child = board_model.get_children_of_peg(current_row, current_column)
 
         if left_child is None and right_child is None:
-            return path_list, None
+            yield ("slot", None)
+            return
 
-        random_value = random.random()
-        if random_value < 0.5:
+        if biased:
+            left_probability = board_model.get_left_probability(current_row, current_column)
+        random_value = generator.random()
+        if random_value < left_probability:
             chosen_child = left_child
             if chosen_child is None:
                 chosen_child = right_child
@@ -39,22 +56,456 @@ def simulate_fall(board_model, start_column):
                 chosen_child = left_child
 
         if chosen_child is None:
-            return path_list, None
+            yield ("slot", None)
+            return
 #if the chosen child is an int, that means its a slot column
         if type(chosen_child) == int:
-            final_slot_column = chosen_child
-            return path_list, final_slot_column
+            yield ("slot", chosen_child)
+            return
         
 #if not a slot then it must be another peg
-        child_row, child_column = chosen_child
-        current_row = child_row
-        current_column = child_column
-        path_list.append((current_row, current_column))
+        current_row, current_column = chosen_child
 
-def simulate_fall_and_score(board_model, start_column):
-    path_list, final_slot_column = simulate_fall(board_model, start_column)
+#the whole fall at once: the pegs the ball touches and its final slot column
+def simulate_fall(board_model, start_column, generator=random):
+    path_list = [] #store all the pegs the ball touches
+    for event in iter_fall(board_model, start_column, generator):
+        if event[0] == "peg":
+            path_list.append((event[1], event[2]))
+        else:
+            return path_list, event[1]
+
+def score_for_slot(board_model, final_slot_column):
     if final_slot_column is None:
-        score = 0
-    else:
-        score = board_model.get_slot_score_at_column(final_slot_column)
+        return 0
+    return board_model.get_slot_score_at_column(final_slot_column)
+
+def simulate_fall_and_score(board_model, start_column, generator=random):
+    path_list, final_slot_column = simulate_fall(board_model, start_column, generator)
+    score = score_for_slot(board_model, final_slot_column)
     return path_list, final_slot_column, score
+
+#compact paths for logging and replay: only pegs with both children make a
+#real choice (a one-sided peg always sends the ball to its other side and a
+#peg with no children loses it), so a path is its start column plus one bit
+#per real choice (1 = right). The bits are packed into one int, choice i at
+#bit i, with a sentinel 1 above the last choice so the length is known:
+#code = (bits | 1 << number_of_choices) * number_of_columns + start_column
+def encode_choices(start_column, choices, number_of_columns):
+    bits = 1 << len(choices)
+    for index in range(len(choices)):
+        if choices[index]:
+            bits = bits | (1 << index)
+    return bits * number_of_columns + start_column
+
+#(start_column, choices) back from a path code, choices as a list of 0/1
+def decode_choices(code, number_of_columns):
+    bits, start_column = divmod(code, number_of_columns)
+    if bits < 1:
+        raise ValueError("Invalid path code")
+    number_of_choices = bits.bit_length() - 1
+    choices = []
+    for index in range(number_of_choices):
+        choices.append((bits >> index) & 1)
+    return start_column, choices
+
+#path code of a fall returned by simulate_fall
+def encode_fall(board_model, start_column, path_list, final_slot_column):
+    choices = []
+    for index in range(len(path_list)):
+        left_child, right_child = board_model.get_children_of_peg(path_list[index][0], path_list[index][1])
+        if left_child is None or right_child is None:
+            continue
+        if index + 1 < len(path_list):
+            next_node = path_list[index + 1]
+        else:
+            next_node = final_slot_column
+        if next_node != left_child and next_node != right_child:
+            raise ValueError("The path does not match the board")
+        choices.append(1 if next_node == right_child else 0)
+    return encode_choices(start_column, choices, board_model.number_of_columns)
+
+#same drop as simulate_fall (it draws the same random numbers, so the same
+#generator state gives the same fall) but only the path code is built.
+#Returns (code, final_slot_column)
+def simulate_fall_encoded(board_model, start_column, generator=random):
+    number_of_columns = board_model.number_of_columns
+    position = first_peg_position_for_column(board_model, start_column)
+    if position is None:
+        return encode_choices(start_column, [], number_of_columns), start_column
+
+    bits = 0
+    number_of_choices = 0
+    current_row, current_column = position
+    biased = board_model.has_biased_pegs()
+    left_probability = 0.5
+    while True:
+        left_child, right_child = board_model.get_children_of_peg(current_row, current_column)
+        if left_child is None and right_child is None:
+            final_slot_column = None
+            break
+        if biased:
+            left_probability = board_model.get_left_probability(current_row, current_column)
+        random_value = generator.random()
+        if left_child is None:
+            chosen_child = right_child
+        elif right_child is None:
+            chosen_child = left_child
+        else:
+            if random_value < left_probability:
+                chosen_child = left_child
+            else:
+                chosen_child = right_child
+                bits = bits | (1 << number_of_choices)
+            number_of_choices = number_of_choices + 1
+        if type(chosen_child) == int:
+            final_slot_column = chosen_child
+            break
+        current_row, current_column = chosen_child
+
+    bits = bits | (1 << number_of_choices)
+    return bits * number_of_columns + start_column, final_slot_column
+
+#rebuilds the exact (path_list, final_slot_column) of a stored path code by
+#walking the board again and taking the recorded choice at every real fork
+def replay_path(board_model, code):
+    if isinstance(code, (bytes, bytearray)):
+        code = path_code_from_bytes(code)
+    bits, start_column = divmod(code, board_model.number_of_columns)
+    if bits < 1:
+        raise ValueError("Invalid path code")
+    number_of_choices = bits.bit_length() - 1
+    path_list = []
+    position = first_peg_position_for_column(board_model, start_column)
+    if position is None:
+        if number_of_choices:
+            raise ValueError("The path code does not match the board")
+        return path_list, start_column
+
+    choice_index = 0
+    current_row, current_column = position
+    while True:
+        path_list.append((current_row, current_column))
+        left_child, right_child = board_model.get_children_of_peg(current_row, current_column)
+        if left_child is None and right_child is None:
+            final_slot_column = None
+            break
+        if left_child is None:
+            chosen_child = right_child
+        elif right_child is None:
+            chosen_child = left_child
+        else:
+            if choice_index == number_of_choices:
+                raise ValueError("The path code does not match the board")
+            if (bits >> choice_index) & 1:
+                chosen_child = right_child
+            else:
+                chosen_child = left_child
+            choice_index = choice_index + 1
+        if type(chosen_child) == int:
+            final_slot_column = chosen_child
+            break
+        current_row, current_column = chosen_child
+
+    if choice_index != number_of_choices:
+        raise ValueError("The path code does not match the board")
+    return path_list, final_slot_column
+
+#path codes as little-endian bytes, for storing many of them
+def path_code_to_bytes(code):
+    return code.to_bytes((code.bit_length() + 7) // 8 or 1, "little")
+
+def path_code_from_bytes(data):
+    return int.from_bytes(data, "little")
+
+#number of drops in each independently seeded block of simulate_drops
+DROP_BLOCK_SIZE = 4096
+
+#drops number block of a seeded run: drops block * block_size up to (at most)
+#number_of_drops, with their own random.Random("seed:block") stream, so a
+#block gives the same counts wherever and whenever it runs.
+#Returns counts[0..C-1] per slot plus counts[C] for the lost balls
+def simulate_block(board_model, start_column, seed, block, block_size, number_of_drops):
+    generator = random.Random("%s:%d" % (seed, block))
+    counts = [0] * (board_model.number_of_columns + 1)
+    first_drop = block * block_size
+    for drop in range(first_drop, min(first_drop + block_size, number_of_drops)):
+        path_list, final_slot_column = simulate_fall(board_model, start_column, generator)
+        if final_slot_column is None:
+            counts[-1] = counts[-1] + 1
+        else:
+            counts[final_slot_column] = counts[final_slot_column] + 1
+    return counts
+
+def number_of_blocks(number_of_drops, block_size):
+    return (number_of_drops + block_size - 1) // block_size
+
+#reproducible Monte Carlo: the drops are cut into fixed blocks, each with its
+#own seeded stream, and the block counts are added up. The result only
+#depends on (seed, number_of_drops, block_size), so batch_solver.simulate_drops_parallel
+#gives exactly the same counts with any number of workers.
+#Returns (slot_counts, lost_count)
+def simulate_drops(board_model, start_column, number_of_drops, seed, block_size=DROP_BLOCK_SIZE):
+    if start_column < 0 or start_column >= board_model.number_of_columns:
+        raise ValueError("Column is out of bounds")
+    counts = [0] * (board_model.number_of_columns + 1)
+    for block in range(number_of_blocks(number_of_drops, block_size)):
+        block_counts = simulate_block(board_model, start_column, seed, block, block_size, number_of_drops)
+        for index in range(len(counts)):
+            counts[index] = counts[index] + block_counts[index]
+    return counts[:-1], counts[-1]
+
+#the CSR graph with simulate_fall's rule for the pegs on the edge: when one
+#side leaves the board the ball always takes the other one, so that single
+#edge gets probability 1 (a peg with no edge at all still loses the ball)
+def build_fall_graph(board_model):
+    return graph_dp.build_csr_graph(board_model, fall_rules=True)
+
+#numpy arrays indexed by node id for moving many balls at once: left[node]
+#and right[node] are the next nodes and left_probability[node] the chance of
+#going left. Pegs are 0..P-1, slots P..P+C-1 and P+C stands for "left the
+#board", slots and P+C point at themselves. Returns (left, right,
+#left_probability, start_ids, peg_cells, number_of_pegs)
+def build_fall_table(board_model):
+    csr_graph = build_fall_graph(board_model)
+    number_of_pegs = csr_graph.number_of_pegs
+    number_of_columns = csr_graph.number_of_columns
+    lost_id = number_of_pegs + number_of_columns
+    offsets = numpy.frombuffer(csr_graph.offsets, dtype=numpy.int32)
+    targets = numpy.frombuffer(csr_graph.targets, dtype=numpy.int32)
+    probabilities = numpy.frombuffer(csr_graph.probabilities, dtype=numpy.float64)
+
+    first_edges = offsets[:number_of_pegs]
+    edge_counts = offsets[1:number_of_pegs + 1] - first_edges
+    left = numpy.arange(lost_id + 1, dtype=numpy.int32)
+    left[:number_of_pegs] = lost_id
+    has_edge = edge_counts > 0
+    left[:number_of_pegs][has_edge] = targets[first_edges[has_edge]]
+    right = left.copy()
+    two_edges = edge_counts == 2
+    right[:number_of_pegs][two_edges] = targets[first_edges[two_edges] + 1]
+    left_probability = numpy.ones(lost_id + 1)
+    left_probability[:number_of_pegs][two_edges] = probabilities[first_edges[two_edges]]
+
+    start_ids = numpy.frombuffer(csr_graph.start_ids, dtype=numpy.int32)
+    peg_cells = numpy.frombuffer(csr_graph.peg_cells, dtype=numpy.int32)
+    return left, right, left_probability, start_ids, peg_cells, number_of_pegs
+
+#drops number_of_drops balls in start_column together: every step moves all
+#balls still on a peg one peg further down with one vectorized draw, so the
+#Python work is one loop per peg level instead of one per bounce per ball.
+#Same rules as simulate_fall (a one-sided peg sends the ball to the other
+#side). Returns (slot_counts, lost_count), slot_counts[column] being the
+#number of balls that landed in that slot, plus, with return_paths, an
+#int32 array paths[ball] of the row * number_of_columns + column of every
+#peg touched, padded with -1. Balls are run in chunks of chunk_size to keep
+#the arrays small
+def simulate_many(board_model, start_column, number_of_drops, return_paths=False, seed=None, chunk_size=1 << 16):
+    if numpy is None:
+        raise RuntimeError("simulate_many needs numpy installed")
+    if start_column < 0 or start_column >= board_model.number_of_columns:
+        raise ValueError("Column is out of bounds")
+    number_of_columns = board_model.number_of_columns
+    left, right, left_probability, start_ids, peg_cells, number_of_pegs = build_fall_table(board_model)
+    generator = numpy.random.default_rng(seed)
+
+    counts = numpy.zeros(number_of_columns + 1, dtype=numpy.int64)
+    path_chunks = []
+    done = 0
+    while done < number_of_drops:
+        count = min(chunk_size, number_of_drops - done)
+        positions = numpy.full(count, start_ids[start_column], dtype=numpy.int32)
+        if start_ids[start_column] < number_of_pegs:
+            active = numpy.arange(count)
+        else:
+            active = numpy.arange(0)
+        steps = []
+        while active.size:
+            nodes = positions[active]
+            if return_paths:
+                step = numpy.full(count, -1, dtype=numpy.int32)
+                step[active] = peg_cells[nodes]
+                steps.append(step)
+            go_left = generator.random(active.size) < left_probability[nodes]
+            nodes = numpy.where(go_left, left[nodes], right[nodes])
+            positions[active] = nodes
+            active = active[nodes < number_of_pegs]
+        counts += numpy.bincount(positions - number_of_pegs, minlength=number_of_columns + 1)
+        if return_paths:
+            path_chunks.append(numpy.stack(steps, axis=1) if steps else numpy.full((count, 0), -1, dtype=numpy.int32))
+        done = done + count
+
+    slot_counts = counts[:number_of_columns]
+    lost_count = int(counts[number_of_columns])
+    if not return_paths:
+        return slot_counts, lost_count
+    width = max([chunk.shape[1] for chunk in path_chunks] + [0])
+    paths = numpy.full((number_of_drops, width), -1, dtype=numpy.int32)
+    row = 0
+    for chunk in path_chunks:
+        paths[row:row + chunk.shape[0], :chunk.shape[1]] = chunk
+        row = row + chunk.shape[0]
+    return slot_counts, lost_count, paths
+
+#Walker/Vose alias table of one discrete distribution: pick a bucket i
+#uniformly, keep it with probability keep[i], otherwise take alias[i].
+#Built in O(n), every draw afterwards is O(1) whatever the distribution
+def build_alias_table(probabilities):
+    number_of_outcomes = len(probabilities)
+    total = sum(probabilities)
+    scaled = [probability * number_of_outcomes / total for probability in probabilities]
+    keep = [1.0] * number_of_outcomes
+    alias = list(range(number_of_outcomes))
+    small = [index for index in range(number_of_outcomes) if scaled[index] < 1.0]
+    large = [index for index in range(number_of_outcomes) if scaled[index] >= 1.0]
+    while small and large:
+        small_index = small.pop()
+        large_index = large.pop()
+        keep[small_index] = scaled[small_index]
+        alias[small_index] = large_index
+        scaled[large_index] = (scaled[large_index] + scaled[small_index]) - 1.0
+        if scaled[large_index] < 1.0:
+            small.append(large_index)
+        else:
+            large.append(large_index)
+    #whatever is left is 1 up to rounding and keeps its own bucket
+    return keep, alias
+
+#landing slot sampler for when the path is not needed: one alias table per
+#start column over the exact landing distribution of simulate_fall (slots
+#0..C-1 plus "left the board" as outcome C), so a drop is two random numbers
+#instead of a walk over every peg. Build it once per peg layout
+class SlotSampler:
+    def __init__(self, board_model):
+        self.board_model = board_model
+        self.number_of_columns = board_model.number_of_columns
+        distributions, lost_list = graph_dp.compute_landing_distributions_csr(build_fall_graph(board_model))
+        self.tables = []
+        for column in range(self.number_of_columns):
+            self.tables.append(build_alias_table(distributions[column] + [lost_list[column]]))
+        #numpy copies of the tables for sample_many, made on first use
+        self.keep_arrays = None
+        self.alias_arrays = None
+
+    #final slot column of one drop, None when the ball leaves the board
+    def sample(self, start_column, generator=random):
+        keep, alias = self.tables[start_column]
+        index = int(generator.random() * len(keep))
+        if generator.random() >= keep[index]:
+            index = alias[index]
+        if index == self.number_of_columns:
+            return None
+        return index
+
+    #(final_slot_column, score) like simulate_fall_and_score without the path
+    def sample_and_score(self, start_column, generator=random):
+        final_slot_column = self.sample(start_column, generator)
+        if final_slot_column is None:
+            return None, 0
+        return final_slot_column, self.board_model.get_slot_score_at_column(final_slot_column)
+
+    #number_of_drops slots at once as an int32 numpy array, -1 for the balls
+    #that left the board
+    def sample_many(self, start_column, number_of_drops, seed=None):
+        if numpy is None:
+            raise RuntimeError("sample_many needs numpy installed")
+        if self.keep_arrays is None:
+            self.keep_arrays = [numpy.array(keep) for keep, alias in self.tables]
+            self.alias_arrays = [numpy.array(alias, dtype=numpy.int32) for keep, alias in self.tables]
+        keep = self.keep_arrays[start_column]
+        alias = self.alias_arrays[start_column]
+        generator = numpy.random.default_rng(seed)
+        indexes = generator.integers(0, len(keep), size=number_of_drops, dtype=numpy.int32)
+        slots = numpy.where(generator.random(number_of_drops) < keep[indexes], indexes, alias[indexes])
+        slots[slots == self.number_of_columns] = -1
+        return slots
+
+#True when simulate_fall and the graph DP agree on what happens at every
+#peg: the DP drops a side that leaves the board while the simulation falls
+#back to the other side, so any peg with exactly one child off the board
+#(only possible in the first and last column) makes them differ
+def simulation_matches_dp(board_model):
+    last_column = board_model.number_of_columns - 1
+    for column in (0, last_column):
+        for row in range(board_model.number_of_rows):
+            if not board_model.is_peg(row, column):
+                continue
+            left_child, right_child = board_model.get_children_of_peg(row, column)
+            if (left_child is None) != (right_child is None):
+                return False
+    return True
+
+#Monte Carlo estimate of every column's expected score that stops on its
+#own: each column still running gets batch_size more drops of
+#simulate_fall_and_score, its mean and variance are updated with Welford's
+#method, and it stops once its confidence interval is at most target_width
+#wide (or after max_drops drops). Returns a report dict with the drops used,
+#the elapsed seconds and, per column, the mean, the interval and whether it
+#converged. When simulation_matches_dp the exact values of
+#graph_dp.compute_expected_values are added, with a check that each one
+#lies inside its interval
+def estimate_expected_scores(board_model, target_width, confidence=0.95, batch_size=1000,
+                             max_drops=1000000, generator=random):
+    if target_width <= 0:
+        raise ValueError("Target width must be positive")
+    if not (0.0 < confidence < 1.0):
+        raise ValueError("Confidence must be between 0 and 1")
+    if batch_size < 2:
+        raise ValueError("Batch size must be at least 2")
+    if max_drops < 2:
+        raise ValueError("Need at least 2 drops per column")
+    z_value = NormalDist().inv_cdf((1.0 + confidence) / 2.0)
+    number_of_columns = board_model.number_of_columns
+    start_time = time.perf_counter()
+
+    counts = [0] * number_of_columns
+    means = [0.0] * number_of_columns
+    squared_sums = [0.0] * number_of_columns #Welford's M2
+    half_widths = [None] * number_of_columns
+    running = list(range(number_of_columns))
+    while running:
+        still_running = []
+        for column in running:
+            count = counts[column]
+            mean = means[column]
+            squared_sum = squared_sums[column]
+            for drop in range(min(batch_size, max_drops - count)):
+                path_list, final_slot_column, score = simulate_fall_and_score(board_model, column, generator)
+                count = count + 1
+                delta = score - mean
+                mean = mean + delta / count
+                squared_sum = squared_sum + delta * (score - mean)
+            counts[column] = count
+            means[column] = mean
+            squared_sums[column] = squared_sum
+            half_widths[column] = z_value * (squared_sum / (count - 1) / count) ** 0.5
+            if 2.0 * half_widths[column] > target_width and count < max_drops:
+                still_running.append(column)
+        running = still_running
+
+    exact_values = None
+    if simulation_matches_dp(board_model):
+        exact_values = graph_dp.compute_expected_values(board_model)
+    column_reports = []
+    for column in range(number_of_columns):
+        report = {
+            "column": column,
+            "drops": counts[column],
+            "mean": means[column],
+            "variance": squared_sums[column] / (counts[column] - 1),
+            "interval": (means[column] - half_widths[column], means[column] + half_widths[column]),
+            "converged": 2.0 * half_widths[column] <= target_width,
+        }
+        if exact_values is not None:
+            report["exact"] = exact_values[column]
+            report["exact_inside_interval"] = report["interval"][0] <= exact_values[column] <= report["interval"][1]
+        column_reports.append(report)
+
+    return {
+        "drops": sum(counts),
+        "elapsed": time.perf_counter() - start_time,
+        "confidence": confidence,
+        "target_width": target_width,
+        "cross_checked": exact_values is not None,
+        "columns": column_reports,
+    }